@@ -1,6 +1,38 @@
 import random
+import threading
+import time
+import chess_engine
 
 DEPTH = 2
+MAX_DEPTH = 5       # Deepest iteration of the iterative deepening search
+TIME_LIMIT = 5      # Seconds the iterative deepening search may spend on a move
+STOP_POLL_INTERVAL = 0.01       # Seconds between checks for a stop request in search_position()
+
+# Selective search, each technique can be turned off on its own
+NULL_MOVE_PRUNING = True
+NULL_MOVE_REDUCTION = 2     # How many plies shallower than a normal move the null move is searched
+LATE_MOVE_REDUCTIONS = True       # Only away from the PV, so it needs the null windows of PRINCIPAL_VARIATION_SEARCH
+LMR_FULL_DEPTH_MOVES = 3        # Moves searched at full depth before the reductions start
+SELECTIVE_MIN_DEPTH = 3     # Neither technique is used closer than this to the leaves
+PRINCIPAL_VARIATION_SEARCH = True
+NULL_WINDOW = 0.01      # Scores aren't whole numbers, so a null window is narrower than one point
+ASPIRATION_WINDOW = 0.5     # Half-width of the window around the previous iteration's score
+MAX_PLY = 64        # Longest line the principal variation table can hold
+# Static exchange evaluation
+SEE_ORDERING = True     # Captures that lose material are searched after the quiet moves
+SEE_PRUNING = True      # Captures that lose material aren't searched close to the leaves
+SEE_PRUNING_DEPTH = 1
+SEE_KING_VALUE = 100        # The king can only capture last, so it's worth more than everything else in an exchange
+QUIESCENCE_SEARCH = False       # Keep searching captures that don't lose material after depth 0
+QUIESCENCE_MAX_DEPTH = 4
+# Transposition table: positions already searched (found again through another move order) aren't searched again
+TRANSPOSITION_TABLE = True
+TRANSPOSITION_TABLE_SIZE = 2 ** 18      # Entries, must be a power of 2
+EXACT, LOWER_BOUND, UPPER_BOUND = 0, 1, 2       # What a stored score is: the score, or a bound on it
+MULTI_PV = 3        # Best moves found by the multi-PV search
+MULTI_PV_DEPTH = 3
+# Analysis cache: results of the alphabeta searches (algo_type 5 and 6) are kept in this file between runs
+ANALYSIS_CACHE_FILE = None
 
 # Scoring each piece
 piece_score = {'K':0, 'Q': 10, 'R': 5, 'B': 3, 'N': 3, 'P': 1} # King's values doesn't matter since no way to capture it,
@@ -79,6 +111,14 @@ piece_position_scores = {"N": knight_scores, "B": bishop_scores, "Q": queen_scor
 CHECKMATE = 1000        # Checkmate is the most important
 STALEMATE = 0       # Stalemate is better than a losing position
 
+# Pawn structure, computed from the pawns alone and cached by the pawn key of the game state
+PAWN_STRUCTURE = True
+DOUBLED_PAWN_PENALTY = 0.3      # For every extra pawn on a file
+ISOLATED_PAWN_PENALTY = 0.3     # For a pawn without pawns of its color on the files next to it
+# For a pawn without enemy pawns in front of it on its file or the files next to it, by how far it has advanced
+PASSED_PAWN_BONUS = [0.1, 0.1, 0.2, 0.35, 0.6, 1.0]
+PAWN_CACHE_SIZE = 2 ** 14       # Entries, must be a power of 2
+
 # Counters for testing and benchmarking
 random_ai_counter = 0
 greedy_ai_counter = 0
@@ -86,6 +126,63 @@ minimax_iterative_ai_counter = 0
 minimax_recursive_ai_counter = 0
 negamax_ai_counter = 0
 negamax_alphabeta_ai_counter = 0
+null_move_cutoff_counter = 0
+lmr_counter = 0
+lmr_research_counter = 0
+pvs_research_counter = 0
+aspiration_research_counter = 0
+iterative_deepening_depth = 0
+quiescence_ai_counter = 0
+see_prune_counter = 0
+transposition_cutoff_counter = 0
+pawn_cache_hit_counter = 0
+pawn_cache_miss_counter = 0
+
+next_move = None
+next_move_score = None      # Score of next_move for the player to move, if the algorithm computes one
+search_deadline = None      # The iterative deepening search stops searching once time.time() passes it
+search_aborted = False
+# Triangular principal variation table, row ply holds the best line found from that ply onwards
+pv_table = [[None] * MAX_PLY for _ in range(MAX_PLY)]
+pv_length = [0] * MAX_PLY
+principal_variation = []        # Best line of the last completed search, starting with next_move
+multi_pv_lines = []     # (move, score, line) of the best moves found by the last multi-PV search, best first
+
+class TranspositionTable():
+    """
+    Stores the result of searching a position, found by its Zobrist key: the depth it was searched to, whether
+    the score is exact or a bound, the score and the id of the best move. A fixed number of entries are kept,
+    and a new entry replaces the one in its slot unless that one is for the same position and deeper
+    """
+    def __init__(self, size=TRANSPOSITION_TABLE_SIZE):
+        self.size = size
+        self.entries = None     # Allocated by the first store, so processes that never search don't pay for it
+
+    def probe(self, key):
+        """
+        Returns (depth, flag, score, move_id) for the position, or None if it isn't stored
+        """
+        if self.entries is None:
+            return None
+        entry = self.entries[key & (self.size - 1)]
+        if entry is None or entry[0] != key:
+            return None
+        return entry[1:]
+
+    def store(self, key, depth, flag, score, move_id):
+        if self.entries is None:
+            self.entries = [None] * self.size
+        index = key & (self.size - 1)
+        entry = self.entries[index]
+        if entry is None or entry[0] != key or entry[1] <= depth:
+            self.entries[index] = (key, depth, flag, score, move_id)
+
+    def clear(self):
+        self.entries = None
+
+transposition_table = TranspositionTable()
+analysis_cache = None       # chess_cache.AnalysisCache of ANALYSIS_CACHE_FILE, opened by the first search using it
+pawn_cache = [None] * PAWN_CACHE_SIZE       # (pawn key, score) of the pawn structures scored
 
 
 def find_random_move(valid_moves):
@@ -220,34 +317,453 @@ def find_negamax_move(gs, valid_moves, depth, turn_multiplier):
         gs.undo_move()
     return max_score
 
-def find_negamax_move_alphabeta(gs, valid_moves, depth, alpha, beta, turn_multiplier):
+def find_negamax_move_alphabeta(gs, valid_moves, depth, alpha, beta, turn_multiplier, ply=0, allow_null=True):
     """
     This function uses negamax algorithm along with alphabeta pruning recursively to return the best move by looking multiple moves ahead. 
-    This is a variant of minimax used in zero-sum games for cleaner and faster code
+    This is a variant of minimax used in zero-sum games for cleaner and faster code.
+    Away from the leaves the search is selective: null move pruning skips nodes where even passing the turn
+    fails high, and late move reductions search quiet moves ordered late at a reduced depth.
+    With principal variation search, every move after the first is only searched with a null window to prove
+    it is worse, and the best line is kept in pv_table.
+    Positions found in the transposition table at a sufficient depth aren't searched again, and the best move
+    stored for them is searched first.
+    The search itself is search_negamax_alphabeta(), this runs it to the end in one go
+    """
+    return run_search(search_negamax_alphabeta(gs, valid_moves, depth, alpha, beta, turn_multiplier, ply, allow_null))
+
+def run_search(search):
+    """
+    Run a search generator to the end and return its result
+    """
+    try:
+        while True:
+            next(search)
+    except StopIteration as result:
+        return result.value
+
+def search_negamax_alphabeta(gs, valid_moves, depth, alpha, beta, turn_multiplier, ply=0, allow_null=True):
     """
-    global negamax_alphabeta_ai_counter
+    The search of find_negamax_move_alphabeta() as a generator, which yields None before every node and returns
+    the score. Whoever drives it can stop between any two nodes and carry on later (see TimeSlicedSearch)
+    """
+    global negamax_alphabeta_ai_counter, null_move_cutoff_counter, lmr_counter, lmr_research_counter
+    global pvs_research_counter, see_prune_counter, transposition_cutoff_counter, next_move, search_aborted
+    yield
     negamax_alphabeta_ai_counter += 1
-    global next_move
+    pv_length[ply] = ply
+    if search_deadline is not None and time.time() > search_deadline:
+        search_aborted = True
+    if search_aborted:
+        return 0
     random.shuffle(valid_moves)     # Prevents the agent from being predictable when multiple moves have same score
     if depth == 0:
+        if QUIESCENCE_SEARCH:
+            return find_quiescence_score(gs, valid_moves, alpha, beta, turn_multiplier, ply)
         return turn_multiplier * score_board(gs)
-    
+
+    alpha_original = alpha
+    entry = transposition_table.probe(gs.zobrist_key) if TRANSPOSITION_TABLE else None
+    if entry is not None:
+        entry_depth, entry_flag, entry_score, _ = entry
+        # The root always searches, so that next_move is set. Neither does a node with a window wider than a
+        # null window (a PV node) stop here, since the table holds no line to put in the principal variation
+        if ply > 0 and beta - alpha <= NULL_WINDOW and entry_depth >= depth and (entry_flag == EXACT or \
+                entry_flag == LOWER_BOUND and entry_score >= beta or entry_flag == UPPER_BOUND and entry_score <= alpha):
+            transposition_cutoff_counter += 1
+            return entry_score
+
+    # Selective search is only worth its overhead away from the leaves, and never while in check.
+    # None means it isn't known yet
+    in_check = gs.in_check() if depth >= SELECTIVE_MIN_DEPTH else None
+
+    # Null move pruning: if passing the turn still fails high, a real move will too. Not used with pawns
+    # only, where passing could be the best move (zugzwang), nor twice in a row
+    if NULL_MOVE_PRUNING and allow_null and ply > 0 and depth >= SELECTIVE_MIN_DEPTH and not in_check \
+            and abs(beta) < CHECKMATE and gs.has_non_pawn_material():
+        gs.make_null_move()
+        next_moves = gs.get_valid_moves()
+        score = -(yield from search_negamax_alphabeta(gs, next_moves, max(depth - 1 - NULL_MOVE_REDUCTION, 0), \
+            -beta, -beta + NULL_WINDOW, -turn_multiplier, ply + 1, False))
+        gs.undo_null_move()
+        if search_aborted:
+            return 0
+        if score >= beta:
+            null_move_cutoff_counter += 1
+            return score
+
+    if ply == 0 and next_move is not None:
+        first_move = next_move
+    elif entry is not None and entry[3] is not None:      # The best move found the last time
+        first_move = next((move for move in valid_moves if move.move_id == entry[3]), None)
+    else:       # Follow the line of the previous search
+        first_move = principal_variation[ply] if ply < len(principal_variation) else None
+    order_moves(valid_moves, first_move, gs)
     max_score = -CHECKMATE
-    for move in valid_moves:
+    best_move = None
+    for move_count, move in enumerate(valid_moves):
+        # Static exchange pruning: close to the leaves, a capture that loses material won't be the best move
+        if SEE_PRUNING and depth <= SEE_PRUNING_DEPTH and move_count > 0 and move.is_capture_move \
+                and not move.is_pawn_promotion and static_exchange_evaluation(gs, move) < 0:
+            if in_check is None:
+                in_check = gs.in_check()
+            if not in_check:
+                see_prune_counter += 1
+                continue
         gs.make_move(move)
         next_moves = gs.get_valid_moves()
-        # Negating the return value for negamax
-        score = -find_negamax_move_alphabeta(gs, next_moves, depth - 1, -beta, -alpha, -turn_multiplier)
+        # Late move reductions: quiet moves that come late in the ordering are rarely best, so search them
+        # shallower with a null window and only search them again at full depth if they beat alpha. Not at the
+        # root or another PV node (a window wider than a null window), whose moves are all searched at full depth
+        reduce = LATE_MOVE_REDUCTIONS and ply > 0 and beta - alpha <= NULL_WINDOW and depth >= SELECTIVE_MIN_DEPTH \
+            and move_count >= LMR_FULL_DEPTH_MOVES and not in_check and not move.is_capture_move and not move.is_pawn_promotion \
+            and next_moves and not gs.in_check()
+        full_depth = True
+        if reduce:
+            lmr_counter += 1
+            score = -(yield from search_negamax_alphabeta(gs, next_moves, depth - 2, -alpha - NULL_WINDOW, -alpha, -turn_multiplier, ply + 1))
+            full_depth = score > alpha
+            if full_depth:
+                lmr_research_counter += 1
+        if full_depth:
+            if PRINCIPAL_VARIATION_SEARCH and move_count > 0:
+                # Assume the moves ordered first were best, and only search the others fully if that's wrong
+                score = -(yield from search_negamax_alphabeta(gs, next_moves, depth - 1, -alpha - NULL_WINDOW, -alpha, -turn_multiplier, ply + 1))
+                if alpha < score < beta:
+                    pvs_research_counter += 1
+                    score = -(yield from search_negamax_alphabeta(gs, next_moves, depth - 1, -beta, -alpha, -turn_multiplier, ply + 1))
+            else:
+                # Negating the return value for negamax
+                score = -(yield from search_negamax_alphabeta(gs, next_moves, depth - 1, -beta, -alpha, -turn_multiplier, ply + 1))
+        gs.undo_move()
+        if search_aborted:
+            return 0
         if score > max_score:
             max_score = score
-            if depth == DEPTH:
+            best_move = move
+            if ply == 0:
                 next_move = move
-        gs.undo_move()
         if max_score > alpha:   # Pruning happens
             alpha = max_score
+            # The move is the new best line from this ply: the move followed by the child's line
+            pv_table[ply][ply] = move
+            pv_table[ply][ply + 1:pv_length[ply + 1]] = pv_table[ply + 1][ply + 1:pv_length[ply + 1]]
+            pv_length[ply] = pv_length[ply + 1]
         if alpha >= beta:
             break
+    # The root isn't stored, since it may have been searched with only some of its moves (multi-PV)
+    if TRANSPOSITION_TABLE and ply > 0:
+        if max_score <= alpha_original:
+            flag = UPPER_BOUND
+        elif max_score >= beta:
+            flag = LOWER_BOUND
+        else:
+            flag = EXACT
+        transposition_table.store(gs.zobrist_key, depth, flag, max_score, \
+            best_move.move_id if best_move is not None else None)
     return max_score
+
+def find_quiescence_score(gs, valid_moves, alpha, beta, turn_multiplier, ply, quiescence_depth=0):
+    """
+    This function keeps searching captures after the search depth has run out, so a position isn't scored in the
+    middle of an exchange. The player to move can also "stand pat" and keep the current score instead of capturing.
+    Captures that lose material according to static_exchange_evaluation() are skipped.
+    A player in check can't stand pat, since passing isn't an option: all their moves (the evasions) are searched
+    """
+    global quiescence_ai_counter, see_prune_counter, search_aborted
+    quiescence_ai_counter += 1
+    pv_length[ply] = ply
+    if search_deadline is not None and time.time() > search_deadline:
+        search_aborted = True
+    if search_aborted:
+        return 0
+    max_score = turn_multiplier * score_board(gs)
+    if gs.check_mate or gs.stale_mate or quiescence_depth >= QUIESCENCE_MAX_DEPTH:
+        return max_score
+    if gs.in_check():
+        max_score = -CHECKMATE
+        moves = valid_moves
+    else:
+        if max_score >= beta:
+            return max_score
+        alpha = max(alpha, max_score)
+        moves = []
+        for move in valid_moves:
+            if move.is_capture_move:
+                if static_exchange_evaluation(gs, move) >= 0:
+                    moves.append(move)
+                else:
+                    see_prune_counter += 1
+    order_moves(moves)
+    for move in moves:
+        gs.make_move(move)
+        next_moves = gs.get_valid_moves()
+        score = -find_quiescence_score(gs, next_moves, -beta, -alpha, -turn_multiplier, ply + 1, quiescence_depth + 1)
+        gs.undo_move()
+        if search_aborted:
+            return 0
+        if score > max_score:
+            max_score = score
+        if max_score > alpha:
+            alpha = max_score
+            pv_table[ply][ply] = move
+            pv_table[ply][ply + 1:pv_length[ply + 1]] = pv_table[ply + 1][ply + 1:pv_length[ply + 1]]
+            pv_length[ply] = pv_length[ply + 1]
+        if alpha >= beta:
+            break
+    return max_score
+
+def order_moves(valid_moves, first_move=None, gs=None):
+    """
+    Sort the moves in place so the ones most likely to be good are searched first: first_move (e.g. the best
+    move of the previous iteration), then captures of the most valuable victim by the least valuable attacker,
+    then promotions, then quiet moves. The sort is stable, so equal moves keep their shuffled order.
+    If gs is given (and SEE_ORDERING is on), captures that lose material go after the quiet moves
+    """
+    if not SEE_ORDERING:
+        gs = None
+    valid_moves.sort(key=lambda move: move_order_score(move, first_move, gs), reverse=True)
+
+def move_order_score(move, first_move=None, gs=None):
+    """
+    Score a move for move ordering, the higher the score the earlier the move is searched
+    """
+    if first_move is not None and move == first_move:
+        return 1000
+    score = 0
+    if move.is_capture_move:
+        see_score = static_exchange_evaluation(gs, move) if gs is not None else 0
+        if see_score < 0:
+            score += -100 + see_score
+        else:
+            score += 100 + 10 * piece_score[move.piece_captured[1]] - piece_score[move.piece_moved[1]]
+    if move.is_pawn_promotion:
+        score += 90
+    return score
+
+def static_exchange_evaluation(gs, move):
+    """
+    Returns the material (in piece_score) the player to move wins with the move once all the captures and recaptures
+    on its end square are played out, each player capturing with their least valuable piece and stopping when
+    carrying on would lose material. Sliding pieces lined up behind an attacker (x-rays) join in once it has
+    captured. Pins and checks are ignored
+    """
+    r, c = move.end_row, move.end_col
+    removed = {(move.start_row, move.start_col)}   # Squares whose pieces have left to capture
+    if move.is_enpassant_move:
+        removed.add((move.start_row, move.end_col))
+    gains = [piece_score[move.piece_captured[1]] if move.is_capture_move else 0]
+    if move.is_pawn_promotion:
+        gains[0] += piece_score[move.promotion_choice] - piece_score['P']
+        value_on_square = piece_score[move.promotion_choice]
+    else:
+        value_on_square = SEE_KING_VALUE if move.piece_moved[1] == 'K' else piece_score[move.piece_moved[1]]
+    color = 'b' if move.piece_moved[0] == 'w' else 'w'
+    while True:
+        attacker = find_least_valuable_attacker(gs.board, r, c, color, removed)
+        if attacker is None:
+            break
+        square, value = attacker
+        # What this player gains by capturing, if the other player stops right after
+        gains.append(value_on_square - gains[-1])
+        value_on_square = value
+        removed.add(square)
+        color = 'b' if color == 'w' else 'w'
+    # Play it back: each player only captures if that's better than stopping
+    for i in range(len(gains) - 1, 0, -1):
+        gains[i - 1] = -max(-gains[i - 1], gains[i])
+    return gains[0]
+
+def find_least_valuable_attacker(board, r, c, color, removed):
+    """
+    Returns the square and exchange value of the least valuable piece of the color attacking (r, c),
+    treating the removed squares as empty, or None if there isn't one
+    """
+    # Pawns attack (r, c) from where a pawn of the other color on (r, c) would attack
+    for square in (chess_engine.BLACK_PAWN_ATTACKS if color == 'w' else chess_engine.WHITE_PAWN_ATTACKS)[r][c]:
+        if board[square[0]][square[1]] == color + 'P' and square not in removed:
+            return square, piece_score['P']
+    for square in chess_engine.KNIGHT_TARGETS[r][c]:
+        if board[square[0]][square[1]] == color + 'N' and square not in removed:
+            return square, piece_score['N']
+    best = None
+    for rays, piece_types in ((chess_engine.BISHOP_RAYS[r][c], ('B', 'Q')), (chess_engine.ROOK_RAYS[r][c], ('R', 'Q'))):
+        for ray in rays:
+            for square in ray:
+                piece = board[square[0]][square[1]]
+                if piece == '--' or square in removed:
+                    continue
+                if piece[0] == color and piece[1] in piece_types and \
+                        (best is None or piece_score[piece[1]] < best[1]):
+                    best = square, piece_score[piece[1]]
+                break       # The first piece on the ray blocks the rest
+    if best is not None:
+        return best
+    for square in chess_engine.KING_TARGETS[r][c]:
+        if board[square[0]][square[1]] == color + 'K' and square not in removed:
+            return square, SEE_KING_VALUE
+    return None
+
+def find_iterative_deepening_move(gs, valid_moves, max_depth, time_limit, min_depth=1, first_move=None, \
+        first_score=0):
+    """
+    This function runs find_negamax_move_alphabeta() one ply deeper at a time, until max_depth is reached or
+    the time limit (in seconds) runs out. The best line of each iteration is searched first in the next one,
+    and an iteration that runs out of time is thrown away.
+    Each iteration starts with an aspiration window around the previous score, which is widened and searched
+    again if the score falls outside of it. The first iteration searches min_depth plies.
+    A search can carry on from an earlier one (e.g. found in the analysis cache) when first_move and first_score
+    are its result at min_depth - 1 plies: the first iteration is then treated like a later one, it can run out
+    of time and first_move is played if it does.
+    The search itself is search_iterative_deepening(), this runs it to the end in one go
+    """
+    return run_search(search_iterative_deepening(gs, valid_moves, max_depth, time_limit, min_depth, first_move, \
+        first_score))
+
+def search_iterative_deepening(gs, valid_moves, max_depth, time_limit, min_depth=1, first_move=None, first_score=0):
+    """
+    The search of find_iterative_deepening_move() as a generator. It yields None before every node, like
+    search_negamax_alphabeta(), and (depth, best move, score) after every completed iteration. Returns the best move
+    """
+    global next_move, next_move_score, search_deadline, search_aborted, iterative_deepening_depth
+    global principal_variation, aspiration_research_counter
+    start_time = time.time()
+    search_aborted = False
+    principal_variation = []
+    best_move = first_move
+    score = first_score
+    if first_move is not None:      # The earlier search counts as the first iteration
+        principal_variation = [first_move]
+        iterative_deepening_depth = min_depth - 1
+        search_deadline = start_time + time_limit
+    turn_multiplier = 1 if gs.white_to_move else -1
+    try:
+        for depth in range(min_depth, max_depth + 1):
+            window = ASPIRATION_WINDOW
+            alpha, beta = (score - window, score + window) if depth > min_depth or first_move is not None \
+                else (-CHECKMATE, CHECKMATE)
+            while True:
+                next_move = best_move
+                new_score = yield from search_negamax_alphabeta(gs, valid_moves, depth, alpha, beta, turn_multiplier)
+                fail_low = new_score <= alpha and alpha > -CHECKMATE
+                fail_high = new_score >= beta and beta < CHECKMATE
+                if search_aborted or not (fail_low or fail_high):
+                    break
+                # The score is only a bound, widen the window on the side it failed on and search again
+                aspiration_research_counter += 1
+                window *= 2
+                if fail_low:
+                    alpha = max(new_score - window, -CHECKMATE)
+                else:
+                    beta = min(new_score + window, CHECKMATE)
+            if search_aborted:
+                break
+            score = new_score
+            best_move = next_move
+            principal_variation = get_principal_variation()
+            iterative_deepening_depth = depth
+            search_deadline = start_time + time_limit     # The first iteration always completes
+            yield depth, best_move, score
+    finally:       # Also when the search is closed before the end
+        search_deadline = None
+        search_aborted = False
+    next_move = best_move
+    next_move_score = score
+    return best_move
+
+class TimeSlicedSearch():
+    """
+    An iterative deepening search that runs a slice of time at a time, so a single process program (like the GUI)
+    can search between frames instead of blocking or starting a search process. It searches its own copy of the
+    position, which can be thrown away at any point with cancel().
+    The searches share this module's globals, so only one can run at a time
+    """
+    def __init__(self, gs, max_depth=None, time_limit=None, min_depth=1):
+        self.gs = chess_engine.GameState.from_snapshot(gs.get_snapshot())
+        self.valid_moves = self.gs.get_valid_moves()
+        self.time_limit = TIME_LIMIT if time_limit is None else time_limit
+        self.search_time = 0        # Seconds spent searching, not counting the time between the slices
+        self.depth = 0      # Deepest completed iteration
+        self.best_move = None
+        self.score = 0
+        self.done = not self.valid_moves
+        # The time limit is checked here, since the search's own deadline would count the time between the slices
+        self.search = search_iterative_deepening(self.gs, self.valid_moves, \
+            MAX_DEPTH if max_depth is None else max_depth, float("inf"), min_depth)
+
+    def step(self, time_slice):
+        """
+        Search for about time_slice seconds. Returns True once the search is done: its last iteration completed,
+        or time_limit seconds of searching have gone by (after at least one iteration)
+        """
+        if self.done:
+            return True
+        start_time = time.perf_counter()
+        try:
+            while time.perf_counter() - start_time < time_slice:
+                iteration = next(self.search)
+                if iteration is not None:
+                    self.depth, self.best_move, self.score = iteration
+        except StopIteration:
+            self.done = True
+        self.search_time += time.perf_counter() - start_time
+        if not self.done and self.depth > 0 and self.search_time >= self.time_limit:
+            self.cancel()
+        return self.done
+
+    def get_best_move(self):
+        """
+        Returns the best move of the deepest completed iteration. Before the first one completes, the best move
+        it has found so far, or any move. None if there are no moves
+        """
+        if self.best_move is not None:
+            return self.best_move
+        if self.search_time > 0 and next_move is not None:
+            return next_move
+        return self.valid_moves[0] if self.valid_moves else None
+
+    def cancel(self):
+        """
+        Stop the search for good, it can be cancelled at any point
+        """
+        self.search.close()
+        self.done = True
+
+def find_multi_pv_moves(gs, valid_moves, num_pv, depth):
+    """
+    Find the num_pv best moves with their scores (for the player to move) and lines, returned best first as
+    (move, score, line) tuples. Each pass searches the root without the moves found by the passes before it,
+    with a full window so the scores are exact. The depths are searched one at a time like in
+    find_iterative_deepening_move(), each pass starting with the move and line of the same rank at the last depth.
+    The passes share the transposition table, so the later ones are much cheaper than the first
+    """
+    global next_move, principal_variation
+    turn_multiplier = 1 if gs.white_to_move else -1
+    lines = []
+    for current_depth in range(1, depth + 1):
+        remaining_moves = list(valid_moves)
+        previous_lines = lines
+        lines = []
+        for rank in range(min(num_pv, len(valid_moves))):
+            next_move, principal_variation = None, []
+            if rank < len(previous_lines) and previous_lines[rank][0] in remaining_moves:
+                next_move, _, principal_variation = previous_lines[rank]
+            score = find_negamax_move_alphabeta(gs, remaining_moves, current_depth, -CHECKMATE, CHECKMATE, \
+                turn_multiplier)
+            if next_move is None:
+                # Every remaining move gets mated, so none scored above -CHECKMATE: take the first one searched
+                next_move = remaining_moves[0]
+            lines.append((next_move, score, get_principal_variation() or [next_move]))
+            remaining_moves.remove(next_move)
+        # The selective search can score a move found by a later pass higher than one found before it
+        lines.sort(key=lambda line: line[1], reverse=True)
+    return lines
+
+def get_principal_variation():
+    """
+    Returns the best line found by the last call of find_negamax_move_alphabeta() from the root
+    """
+    return pv_table[0][:pv_length[0]]
+
 def score_board(gs):
     """
     Score the board based on material AND other rules.
@@ -262,28 +778,96 @@ def score_board(gs):
         return STALEMATE
     
     score = 0
-    # pylint: disable=locally-disabled, consider-using-enumerate
-    for row in range(len(gs.board)):
-        for col in range(len(gs.board[row])):
+    # Only the occupied squares are visited, using the game state's piece lists
+    for square, locations in gs.piece_squares.items():
+        if not locations:
+            continue
+        # No position table for the king. The pawns' tables depend on their color
+        position_scores = None if square[1] == "K" else \
+            piece_position_scores[square if square[1] == "P" else square[1]]
+        for row, col in locations:
+            # Score it positionally with a factor of 0.3
+            piece_position_score = position_scores[row][col] if position_scores else 0
             # Since this is a zero-sum game, whatever points white gains, black loses, so white would
             # add to the score, while black will subtract
-            square = gs.board[row][col]
-            if square != '--':
-                piece_position_score = 0
-                # Score it positionally with a factor of 0.3
-                if square[1] != "K": # No position table for the king
-                    # For pawns
-                    if square[1] == "P":
-                        piece_position_score = piece_position_scores[square][row][col]
-                    # For other pieces
-                    else:
-                        piece_position_score = piece_position_scores[square[1]][row][col]
-                        
-                if square[0] == 'w':        # If it's a white piece 
-                    score += piece_score[square[1]] + piece_position_score * 0.3
-                elif square[0] == 'b':
-                    score -= piece_score[square[1]] + piece_position_score * 0.3
+            if square[0] == 'w':        # If it's a white piece
+                score += piece_score[square[1]] + piece_position_score * 0.3
+            else:
+                score -= piece_score[square[1]] + piece_position_score * 0.3
+    if PAWN_STRUCTURE:
+        score += score_pawn_structure(gs)
+    return score
+
+def score_pawn_structure(gs):
+    """
+    Score the doubled, isolated and passed pawns, positive for white. The pawns change in few of the moves
+    searched, so the score is cached by the pawn key and is rarely computed
+    """
+    global pawn_cache_hit_counter, pawn_cache_miss_counter
+    index = gs.pawn_key & (PAWN_CACHE_SIZE - 1)
+    entry = pawn_cache[index]
+    if entry is not None and entry[0] == gs.pawn_key:
+        pawn_cache_hit_counter += 1
+        return entry[1]
+    pawn_cache_miss_counter += 1
+    score = evaluate_pawn_structure(gs.piece_squares['wP'], gs.piece_squares['bP'])
+    pawn_cache[index] = (gs.pawn_key, score)
     return score
+
+def clear_pawn_cache():
+    """
+    Forget the pawn structures scored, so a benchmark run doesn't get the hits of the runs before it
+    """
+    pawn_cache[:] = [None] * PAWN_CACHE_SIZE
+
+def evaluate_pawn_structure(white_pawns, black_pawns):
+    """
+    Score the structure of the pawns on the given squares, positive for white
+    """
+    score = 0
+    for pawns, enemy_pawns, sign in ((white_pawns, black_pawns, 1), (black_pawns, white_pawns, -1)):
+        pawns_on_file = [0] * 8
+        for _, col in pawns:
+            pawns_on_file[col] += 1
+        for pawn_count in pawns_on_file:
+            if pawn_count > 1:
+                score -= sign * DOUBLED_PAWN_PENALTY * (pawn_count - 1)
+        for row, col in pawns:
+            if (col == 0 or not pawns_on_file[col - 1]) and (col == 7 or not pawns_on_file[col + 1]):
+                score -= sign * ISOLATED_PAWN_PENALTY
+            # White pawns move up the board (to lower rows), black pawns down
+            if all(abs(enemy_col - col) > 1 or (enemy_row - row) * sign >= 0 for enemy_row, enemy_col in enemy_pawns):
+                score += sign * PASSED_PAWN_BONUS[6 - row if sign == 1 else row - 1]
+    return score
+
+def load_evaluation(path):
+    """
+    Load piece values and piece position tables from a JSON file (as written by chess_tuning.py), replacing
+    the ones above. The tables are updated in place, so piece_position_scores keeps pointing at them
+    """
+    import json     # Only needed here, and slow to import for a search process that never loads an evaluation
+    with open(path, encoding="utf-8") as evaluation_file:
+        evaluation = json.load(evaluation_file)
+    piece_score.update(evaluation.get("piece_score", {}))
+    for key, table in evaluation.get("piece_position_scores", {}).items():
+        piece_position_scores[key][:] = table
+
+def get_analysis_fingerprint():
+    """
+    A 64-bit hash of what the analyses of algorithms 5 and 6 depend on: the evaluation, the search settings and
+    the code of the engine. The analysis cache is emptied when it changes, e.g. after load_evaluation()
+    """
+    import hashlib      # Only needed with an analysis cache
+    settings = (piece_score, piece_position_scores, CHECKMATE, STALEMATE, PAWN_STRUCTURE, DOUBLED_PAWN_PENALTY, \
+        ISOLATED_PAWN_PENALTY, PASSED_PAWN_BONUS, NULL_MOVE_PRUNING, NULL_MOVE_REDUCTION, LATE_MOVE_REDUCTIONS, \
+        LMR_FULL_DEPTH_MOVES, SELECTIVE_MIN_DEPTH, PRINCIPAL_VARIATION_SEARCH, SEE_ORDERING, SEE_PRUNING, \
+        SEE_PRUNING_DEPTH, QUIESCENCE_SEARCH, QUIESCENCE_MAX_DEPTH, TRANSPOSITION_TABLE)
+    digest = hashlib.blake2b(repr(settings).encode(), digest_size=8)
+    for module_path in (__file__, chess_engine.__file__):
+        with open(module_path, "rb") as module_file:
+            digest.update(module_file.read())
+    return int.from_bytes(digest.digest(), "little")
+
 def score_material(board):
     """
     Score the board based on material
@@ -299,25 +883,89 @@ def score_material(board):
                 score -= piece_score[square[1]]
     return score
 
-def find_best_move(gs, valid_moves, algo_type, return_queue):
+def reset_counters():
+    """
+    Set all the counters for testing and benchmarking back to zero
+    """
+    global random_ai_counter, greedy_ai_counter, minimax_iterative_ai_counter, minimax_recursive_ai_counter
+    global negamax_ai_counter, negamax_alphabeta_ai_counter, null_move_cutoff_counter, lmr_counter
+    global lmr_research_counter, pvs_research_counter, aspiration_research_counter, iterative_deepening_depth
+    global quiescence_ai_counter, see_prune_counter, transposition_cutoff_counter, pawn_cache_hit_counter
+    global pawn_cache_miss_counter
+    random_ai_counter = greedy_ai_counter = minimax_iterative_ai_counter = minimax_recursive_ai_counter = 0
+    negamax_ai_counter = negamax_alphabeta_ai_counter = null_move_cutoff_counter = lmr_counter = 0
+    lmr_research_counter = pvs_research_counter = aspiration_research_counter = iterative_deepening_depth = 0
+    quiescence_ai_counter = see_prune_counter = transposition_cutoff_counter = 0
+    pawn_cache_hit_counter = pawn_cache_miss_counter = 0
+
+def count_nodes():
+    """
+    Total number of positions visited by all the algorithms since the counters were last reset
+    """
+    return random_ai_counter + greedy_ai_counter + minimax_iterative_ai_counter + minimax_recursive_ai_counter + \
+        negamax_ai_counter + negamax_alphabeta_ai_counter + quiescence_ai_counter
+
+def find_best_move(gs, valid_moves, algo_type, return_queue=None):
     """
     A helper function for the first recursive call of find_minimax_move_recursively() function 
-    that will return the global variable next_move
+    that will return the global variable next_move. The move is also put in return_queue if one is given.
+    With ANALYSIS_CACHE_FILE set, algorithms 5 and 6 look the position up in the analysis cache first
+    and add their result to it. Algorithm 6 carries on from an analysis too shallow to play
     """
-    global next_move
+    global next_move, next_move_score, principal_variation, multi_pv_lines, analysis_cache
     next_move = None
-    if algo_type == 0:
+    next_move_score = None
+    multi_pv_lines = []
+    turn_multiplier = 1 if gs.white_to_move else -1
+    # A position analyzed before, at least as deep as this search would go, isn't searched again.
+    # A shallower analysis gives the iterative deepening search a head start instead
+    cached_analysis = warm_start = None
+    if ANALYSIS_CACHE_FILE and algo_type in (5, 6):
+        # Opened again when the settings change, which empties a cache made with other settings
+        fingerprint = get_analysis_fingerprint()
+        if analysis_cache is None or analysis_cache.path != ANALYSIS_CACHE_FILE \
+                or analysis_cache.fingerprint != fingerprint:
+            import chess_cache      # Imported on first use, like json in load_evaluation()
+            if analysis_cache is not None:
+                analysis_cache.close()
+            analysis_cache = chess_cache.AnalysisCache(ANALYSIS_CACHE_FILE, fingerprint)
+        cached_analysis = analysis_cache.lookup(gs.zobrist_key)
+        if cached_analysis is not None:
+            move_id, score, depth = cached_analysis
+            cached_move = next((move for move in valid_moves if move.move_id == move_id), None)
+            if cached_move is not None and algo_type == 6 and depth < MAX_DEPTH:
+                warm_start = cached_move, score, depth
+            if cached_move is None or depth < (DEPTH if algo_type == 5 else MAX_DEPTH):
+                cached_analysis = None
+    if cached_analysis is not None:
+        next_move, next_move_score, principal_variation = cached_move, score, [cached_move]
+        print("Analysis cache hit, depth:", depth)
+    elif algo_type == 0:
         next_move = find_random_move(valid_moves)
     elif algo_type == 1:
         next_move = find_greedy_move(gs,valid_moves)
     elif algo_type == 2:
         next_move = find_minimax_move_iteratively(gs, valid_moves)
     elif algo_type == 3:
-        find_minimax_move_recursively(gs, valid_moves, DEPTH, gs.white_to_move)
+        next_move_score = turn_multiplier * find_minimax_move_recursively(gs, valid_moves, DEPTH, gs.white_to_move)
     elif algo_type == 4:
-        find_negamax_move(gs, valid_moves, DEPTH, 1 if gs.white_to_move else -1)
+        next_move_score = find_negamax_move(gs, valid_moves, DEPTH, turn_multiplier)
     elif algo_type == 5:
-        find_negamax_move_alphabeta(gs, valid_moves, DEPTH, -CHECKMATE, CHECKMATE, 1 if gs.white_to_move else -1)
+        principal_variation = []
+        next_move_score = find_negamax_move_alphabeta(gs, valid_moves, DEPTH, -CHECKMATE, CHECKMATE, turn_multiplier)
+        principal_variation = get_principal_variation()
+    elif algo_type == 6 and warm_start is not None:
+        cached_move, score, depth = warm_start
+        print("Analysis cache warm start, depth:", depth)
+        find_iterative_deepening_move(gs, valid_moves, MAX_DEPTH, TIME_LIMIT, depth + 1, cached_move, score)
+    elif algo_type == 6:
+        find_iterative_deepening_move(gs, valid_moves, MAX_DEPTH, TIME_LIMIT)
+    elif algo_type == 7:
+        multi_pv_lines = find_multi_pv_moves(gs, valid_moves, MULTI_PV, MULTI_PV_DEPTH)
+        next_move, next_move_score, principal_variation = multi_pv_lines[0] if multi_pv_lines else (None, None, [])
+    if ANALYSIS_CACHE_FILE and algo_type in (5, 6) and cached_analysis is None and next_move is not None:
+        analysis_cache.store(gs.zobrist_key, next_move.move_id, next_move_score, \
+            DEPTH if algo_type == 5 else iterative_deepening_depth)
     if random_ai_counter:
         print("Random AI counter:", random_ai_counter)
     if greedy_ai_counter:
@@ -330,4 +978,62 @@ def find_best_move(gs, valid_moves, algo_type, return_queue):
         print("Negamax AI counter:", negamax_ai_counter)
     if negamax_alphabeta_ai_counter:
         print("Negamax alphabeta AI counter:", negamax_alphabeta_ai_counter)
-    return_queue.put(next_move)
+    if quiescence_ai_counter:
+        print("Quiescence AI counter:", quiescence_ai_counter)
+    if null_move_cutoff_counter:
+        print("Null move cutoff counter:", null_move_cutoff_counter)
+    if transposition_cutoff_counter:
+        print("Transposition table cutoff counter:", transposition_cutoff_counter)
+    if pawn_cache_hit_counter + pawn_cache_miss_counter:
+        print(f"Pawn cache hit rate: {pawn_cache_hit_counter / (pawn_cache_hit_counter + pawn_cache_miss_counter):.1%}")
+    if see_prune_counter:
+        print("Static exchange pruning counter:", see_prune_counter)
+    if lmr_counter:
+        print("Late move reduction counter:", lmr_counter, "re-searched:", lmr_research_counter)
+    if pvs_research_counter:
+        print("Principal variation search re-search counter:", pvs_research_counter)
+    if aspiration_research_counter:
+        print("Aspiration window re-search counter:", aspiration_research_counter)
+    if iterative_deepening_depth:
+        print("Iterative deepening depth reached:", iterative_deepening_depth)
+    if algo_type >= 5 and principal_variation:
+        print("Principal variation:", " ".join(str(move) for move in principal_variation))
+    for rank, (move, score, line) in enumerate(multi_pv_lines, 1):
+        print(f"{rank}. {move} ({score:+.2f}):", " ".join(str(move) for move in line))
+    if return_queue is not None:
+        return_queue.put(next_move)
+    return next_move
+
+def search_position(snapshot, algo_type, return_queue, stop_time=None, analysis_cache_file=None):
+    """
+    Search the position of a snapshot with find_best_move(), meant to run in a background process, and put the
+    best move, the principal variation and the lines of the multi-PV search (algo_type 7) in return_queue.
+    With stop_time (a shared multiprocessing.Value) the iterative deepening search has no time limit of its own:
+    it runs until stop_time is set to a time.time() that has passed, e.g. when pondering on the opponent's time.
+    It still completes its first iteration, so there is always a move. The other algorithms search to their depth.
+    analysis_cache_file sets ANALYSIS_CACHE_FILE in the process: a process started with the spawn or forkserver
+    method imports this module again, so it doesn't see the settings of the process that started it
+    """
+    global TIME_LIMIT, ANALYSIS_CACHE_FILE
+    if analysis_cache_file is not None:
+        ANALYSIS_CACHE_FILE = analysis_cache_file
+    gs = chess_engine.GameState.from_snapshot(snapshot)
+    valid_moves = gs.get_valid_moves()
+    reset_counters()
+    searching = threading.Event()
+    if stop_time is not None:
+        TIME_LIMIT = float("inf")
+        searching.set()
+
+        def watch():
+            global search_aborted
+            while searching.is_set():
+                # The search clears search_aborted when it starts, so keep setting it
+                if stop_time.value and time.time() > stop_time.value and iterative_deepening_depth:
+                    search_aborted = True
+                time.sleep(STOP_POLL_INTERVAL)
+
+        threading.Thread(target=watch, daemon=True).start()
+    best_move = find_best_move(gs, valid_moves, algo_type)
+    searching.clear()
+    return_queue.put((best_move, principal_variation, multi_pv_lines))
@@ -0,0 +1,153 @@
+'''
+Benchmark for the AI agent. Runs each algorithm over a fixed set of positions at a fixed depth, records the nodes,
+time, nodes per second, best move and score in a JSON file, and compares them with a stored baseline.
+A different node count means the search behaves differently, while a lower nodes per second means it got slower.
+Usage: python chess_benchmark.py [--depth 2] [--algos 3 4 5] [--baseline benchmark_baseline.json] [--save-baseline]
+'''
+import argparse
+import contextlib
+import io
+import json
+import queue
+import random
+import sys
+import time
+import chess_engine
+import chess_ai_agent as ai
+
+# Bump the version whenever the positions (or how they're searched) change, old results can't be compared then
+BENCHMARK_VERSION = 2
+# Each position is given as the moves leading to it from the starting position
+BENCHMARK_POSITIONS = [
+    ("start", ""),
+    ("italian", "e2e4 e7e5 g1f3 b8c6 f1c4 g8f6"),
+    ("scholars_mate", "e2e4 e7e5 d1h5 b8c6 f1c4 g8f6"),
+    ("open_center", "e2e4 e7e5 g1f3 b8c6 f1c4 g8f6 e1g1 f8c5 d2d4 e5d4 e4e5 d7d5"),
+    ("queens_gambit", "d2d4 d7d5 c2c4 e7e6 b1c3 g8f6 c1g5 f8e7"),
+    ("promotion", "e2e4 d7d5 e4d5 c7c6 d5c6 g8f6 c6b7 e7e6"),
+    # White is in check: taking the queen or blocking is fine, but every other move is mated, so the last
+    # multi-PV pass finds nothing above -CHECKMATE
+    ("lost_to_mate", "g2g3 d7d5 a2a4 g7g5 h2h3 d8d7 d2d3 b7b5 b1d2 f8g7 b2b4 g7d4 f1g2 e8d8 e2e4 f7f6 d2c4 d7e8 " \
+        "e1d2 b5a4 e4d5 e8h5 h3h4 h5g4 g2e4 g4f4"),
+]
+BENCHMARK_ALGORITHMS = {0: "random", 1: "greedy", 2: "minimax iterative", 3: "minimax recursive", 4: "negamax", \
+    5: "negamax alphabeta", 6: "iterative deepening", 7: "multi-PV"}
+BENCHMARK_SEED = 0
+DEFAULT_RESULTS_FILE = "benchmark_results.json"
+DEFAULT_BASELINE_FILE = "benchmark_baseline.json"
+NPS_THRESHOLD = 0.2     # Flag a slowdown of more than 20% nodes per second
+
+def load_position(moves):
+    """
+    Play the moves (in the "e2e4" notation of Move.__str__) from the starting position
+    """
+    gs = chess_engine.GameState()
+    for move_text in moves.split():
+        for move in gs.get_valid_moves():
+            if str(move) == move_text:
+                gs.make_move(move)
+                break
+        else:
+            raise ValueError(f"{move_text} isn't a valid move after {' '.join(str(move) for move in gs.move_log)}")
+    return gs
+
+def run_benchmark(algo_types, depth, seed=BENCHMARK_SEED):
+    """
+    Search every benchmark position with every algorithm in algo_types, and return a result for each run
+    """
+    ai.DEPTH = ai.MAX_DEPTH = ai.MULTI_PV_DEPTH = depth
+    ai.TIME_LIMIT = float("inf")        # Fixed depth, the iterative deepening search shouldn't stop early
+    results = []
+    for algo_type in algo_types:
+        for name, moves in BENCHMARK_POSITIONS:
+            gs = load_position(moves)
+            valid_moves = gs.get_valid_moves()
+            ai.reset_counters()
+            ai.transposition_table.clear()      # Every run starts from empty tables
+            ai.clear_pawn_cache()
+            random.seed(seed)       # The algorithms shuffle the moves, seeding makes the node counts repeatable
+            return_queue = queue.Queue()
+            start_time = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):     # Hide the counters find_best_move prints
+                ai.find_best_move(gs, valid_moves, algo_type, return_queue)
+            elapsed = time.perf_counter() - start_time
+            best_move = return_queue.get()
+            nodes = ai.count_nodes()
+            results.append({"algo_type": algo_type, "algorithm": BENCHMARK_ALGORITHMS[algo_type], "position": name, \
+                "nodes": nodes, "time": round(elapsed, 4), "nps": round(nodes / elapsed, 1) if elapsed else 0.0, \
+                "best_move": str(best_move) if best_move else None, \
+                "score": round(ai.next_move_score, 4) if ai.next_move_score is not None else None})
+    return results
+
+def compare_results(results, baseline, nps_threshold=NPS_THRESHOLD):
+    """
+    Compare the results with the baseline results and return a message for each changed node count
+    and each nodes per second regression beyond the threshold
+    """
+    baseline_runs = {(run["algo_type"], run["position"]): run for run in baseline}
+    problems = []
+    for run in results:
+        old_run = baseline_runs.get((run["algo_type"], run["position"]))
+        if old_run is None:
+            continue
+        label = f"{run['algorithm']} on {run['position']}"
+        if run["nodes"] != old_run["nodes"]:
+            problems.append(f"NODES CHANGED {label}: {old_run['nodes']} -> {run['nodes']}")
+        if old_run["nps"] and run["nps"] < old_run["nps"] * (1 - nps_threshold):
+            problems.append(f"NPS REGRESSION {label}: {old_run['nps']} -> {run['nps']} " \
+                f"({(run['nps'] / old_run['nps'] - 1) * 100:.1f}%)")
+    return problems
+
+def print_results(results):
+    """
+    Print the results as a table
+    """
+    print(f"{'algorithm':<20}{'position':<16}{'nodes':>10}{'time':>10}{'nps':>10}  {'move':<6}{'score':>8}")
+    for run in results:
+        score = "" if run["score"] is None else f"{run['score']:.2f}"
+        print(f"{run['algorithm']:<20}{run['position']:<16}{run['nodes']:>10}{run['time']:>10.3f}{run['nps']:>10.0f}" \
+            f"  {str(run['best_move']):<6}{score:>8}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the chess AI algorithms")
+    parser.add_argument("--algos", type=int, nargs="+", default=sorted(BENCHMARK_ALGORITHMS), \
+        choices=sorted(BENCHMARK_ALGORITHMS), help="algo_type values to run (default: all)")
+    parser.add_argument("--depth", type=int, default=2, help="search depth (default: 2)")
+    parser.add_argument("--seed", type=int, default=BENCHMARK_SEED, help="random seed for move shuffling")
+    parser.add_argument("--output", default=DEFAULT_RESULTS_FILE, help="JSON file the results are written to")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_FILE, help="JSON file with the baseline results")
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--nps-threshold", type=float, default=NPS_THRESHOLD, \
+        help="flag nodes per second drops bigger than this fraction (default: 0.2)")
+    args = parser.parse_args()
+
+    results = run_benchmark(args.algos, args.depth, args.seed)
+    print_results(results)
+    report = {"version": BENCHMARK_VERSION, "depth": args.depth, "seed": args.seed, "results": results}
+    with open(args.output, "w", encoding="utf-8") as results_file:
+        json.dump(report, results_file, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as baseline_file:
+            json.dump(report, baseline_file, indent=2)
+        print("Saved baseline to", args.baseline)
+        return 0
+
+    try:
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)
+    except FileNotFoundError:
+        print("No baseline found at", args.baseline, "- run with --save-baseline to create one")
+        return 0
+    if (baseline["version"], baseline["depth"], baseline["seed"]) != (BENCHMARK_VERSION, args.depth, args.seed):
+        print("The baseline was made with a different version, depth or seed, not comparing")
+        return 0
+    problems = compare_results(results, baseline["results"], args.nps_threshold)
+    for problem in problems:
+        print(problem)
+    if not problems:
+        print("No changes from the baseline")
+    return 1 if problems else 0
+
+# Best practice to ensure the function only runs when the file is run directly
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+'''
+Persistent analysis cache: the best move, score and depth of every position searched, kept on disk between runs.
+The file is a header followed by a hash table of fixed-size records, and it is read and written through a memory
+map, so opening it costs nothing however full it is, and processes using the same file see each other's writes
+right away. A position is looked for in the few slots after the one its Zobrist key hashes to; when they are all
+taken, the shallowest analysis among them is replaced.
+The header holds a fingerprint of the evaluation and search settings the analyses were made with. A file opened
+with another fingerprint is replaced by an empty one, so analyses of an old evaluation are never played.
+Like the shared transposition table of chess_smp.py, a record holds the key XORed with the rest of the record,
+so a record torn by two processes writing it at once doesn't match any key and is ignored.
+Usage: python chess_cache.py analysis_cache.bin     (prints statistics)
+'''
+import argparse
+import mmap
+import os
+import struct
+
+MAGIC = b"CHESSAC\x02"      # File type and version
+HEADER_FORMAT = struct.Struct("<8sQ")       # Magic, fingerprint of the settings the analyses were made with
+HEADER_SIZE = HEADER_FORMAT.size        # A multiple of 8, so the records stay aligned
+RECORD_FORMAT = struct.Struct("<QfHBx")     # Zobrist key ^ data, then the data: score, move id, depth
+DATA_FORMAT = struct.Struct("<fHBx")        # Score for the player to move, move id, depth
+RECORD_SIZE = RECORD_FORMAT.size
+MAX_CACHE_SIZE = 64 * 2 ** 20       # Bytes of a new cache file, it never grows past that
+DEPTH_OFFSET = 14       # Where a record's depth is, for counting the positions
+PROBE_SLOTS = 4     # Slots a position may be stored in, starting with the one its key hashes to
+
+class AnalysisCache():
+    """
+    An analysis cache file, created if it doesn't exist. A file made with a fingerprint other than the one given
+    is replaced by an empty table, fingerprint None opens the file whatever its fingerprint is (a new file gets 0).
+    Raises ValueError if the file isn't an analysis cache
+    """
+    def __init__(self, path, fingerprint=None, max_size=MAX_CACHE_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self.hits = self.misses = self.writes = 0
+        self.file = open(path, "a+b")
+        size = os.fstat(self.file.fileno()).st_size
+        if size == 0:
+            self.create_table(self.file, fingerprint or 0)
+        else:
+            self.file.seek(0)
+            header = self.file.read(HEADER_SIZE)
+            if len(header) != HEADER_SIZE or HEADER_FORMAT.unpack(header)[0] != MAGIC \
+                    or (size - HEADER_SIZE) % RECORD_SIZE:
+                self.file.close()
+                raise ValueError(f"{path} isn't an analysis cache")
+            if fingerprint is not None and HEADER_FORMAT.unpack(header)[1] != fingerprint:
+                self.file.close()
+                self.replace_table(fingerprint)
+                self.file = open(path, "a+b")
+        # Writes through the map go to the file, whatever mode it was opened in
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        self.slots = (len(self.map) - HEADER_SIZE) // RECORD_SIZE
+        self.fingerprint = HEADER_FORMAT.unpack(self.map[:HEADER_SIZE])[1]
+
+    def create_table(self, table_file, fingerprint):
+        """
+        Write the header and an empty table to a new file. The records are zero, which most systems store sparsely
+        """
+        table_file.write(HEADER_FORMAT.pack(MAGIC, fingerprint))
+        table_file.truncate(HEADER_SIZE + max(self.max_size - HEADER_SIZE, RECORD_SIZE) // RECORD_SIZE * RECORD_SIZE)
+        table_file.flush()
+
+    def replace_table(self, fingerprint):
+        """
+        Replace the file with an empty table. The new file takes the place of the old one, so processes that still
+        have the old one mapped carry on with it instead of reading a file cut short under them
+        """
+        temporary_path = self.path + ".new"
+        with open(temporary_path, "wb") as table_file:
+            self.create_table(table_file, fingerprint)
+        os.replace(temporary_path, self.path)
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def read_slot(self, slot):
+        """
+        Returns (key, score, move_id, depth) of the record in the slot, depth is 0 for an empty slot
+        """
+        offset = HEADER_SIZE + slot * RECORD_SIZE
+        stored_key = int.from_bytes(self.map[offset:offset + 8], "little")
+        data = self.map[offset + 8:offset + RECORD_SIZE]
+        return (stored_key ^ int.from_bytes(data, "little"),) + DATA_FORMAT.unpack(data)[:3]
+
+    def lookup(self, key):
+        """
+        Returns (move_id, score, depth) of the analysis of the position, or None
+        """
+        for i in range(PROBE_SLOTS):
+            slot_key, score, move_id, depth = self.read_slot((key + i) % self.slots)
+            if slot_key == key and depth > 0:
+                self.hits += 1
+                return move_id, score, depth
+        self.misses += 1
+        return None
+
+    def store(self, key, move_id, score, depth):
+        """
+        Write an analysis, unless the cache already has one at least as deep
+        """
+        replaced_slot = replaced_depth = None
+        for i in range(PROBE_SLOTS):
+            slot = (key + i) % self.slots
+            slot_key, _, _, slot_depth = self.read_slot(slot)
+            if slot_key == key and slot_depth > 0:
+                if slot_depth >= depth:
+                    return
+                replaced_slot = slot
+                break
+            if replaced_depth is None or slot_depth < replaced_depth:       # An empty slot has depth 0
+                replaced_slot, replaced_depth = slot, slot_depth
+        data = DATA_FORMAT.pack(score, move_id, depth)
+        offset = HEADER_SIZE + replaced_slot * RECORD_SIZE
+        self.map[offset:offset + RECORD_SIZE] = (key ^ int.from_bytes(data, "little")).to_bytes(8, "little") + data
+        self.writes += 1
+
+    def get_stats(self):
+        """
+        Counting the positions reads the whole table, which takes a while for a big one
+        """
+        positions = sum(1 for slot in range(self.slots) if self.map[HEADER_SIZE + slot * RECORD_SIZE + DEPTH_OFFSET])
+        return {"positions": positions, "slots": self.slots, "size": len(self.map), "fingerprint": self.fingerprint, \
+            "hits": self.hits, "misses": self.misses, "writes": self.writes}
+
+def main():
+    parser = argparse.ArgumentParser(description="Statistics of an analysis cache file")
+    parser.add_argument("path")
+    args = parser.parse_args()
+    cache = AnalysisCache(args.path)
+    for name, value in cache.get_stats().items():
+        if name in ("positions", "slots", "size", "fingerprint"):
+            print(f"{name}: {value}")
+    cache.close()
+
+# Best practice to ensure the function only runs when the file is run directly
+if __name__ == "__main__":
+    main()
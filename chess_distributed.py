@@ -0,0 +1,326 @@
+'''
+Distributed analysis over TCP. Workers listen on a TCP port, on this machine or others, and search the positions
+a coordinator sends them. The coordinator hands the positions out to all of its workers, sends a position again
+(to any worker) when its worker fails or times out, and reports the throughput of the run.
+Every message has a fixed size: a request is a job id and the search parameters followed by the position's
+snapshot, and the worker answers each request as soon as its search is done.
+Usage:
+    python chess_distributed.py worker --port 5555      (one worker per core, each on its own port)
+    python chess_distributed.py worker --host 0.0.0.0 --port 5555       (for coordinators on other hosts)
+    python chess_distributed.py coordinate --workers host1:5555 host2:5555 [--pgn games.pgn] [--output results.jsonl]
+    python chess_distributed.py local --processes 2      (starts the workers on localhost and coordinates them)
+'''
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import math
+import multiprocessing
+import socket
+import socketserver
+import struct
+import sys
+import time
+import chess_engine
+import chess_ai_agent as ai
+import chess_benchmark
+import chess_pgn
+
+PROTOCOL_MAGIC = b"CHESSWK1"     # Sent by a worker when a coordinator connects
+REQUEST_FORMAT = struct.Struct("<IBBd")     # Job id, algo_type, depth, time limit, followed by the snapshot
+REQUEST_SIZE = REQUEST_FORMAT.size + chess_engine.SNAPSHOT_SIZE
+RESULT_FORMAT = struct.Struct("<IBHdQd")        # Job id, status, move id, score, nodes, search time
+RESULT_OK, RESULT_ERROR = 0, 1
+DEFAULT_HOST = "127.0.0.1"      # Only this machine by default, since workers search for anyone who connects
+DEFAULT_PORT = 5555
+DEFAULT_ALGO_TYPE = 6
+DEFAULT_DEPTH = 3
+DEFAULT_TIME_LIMIT = 2
+CONNECT_TIMEOUT = 5     # Seconds
+JOB_TIMEOUT_GRACE = 30      # Seconds a search may take beyond its time limit before its worker is given up on
+JOB_TIMEOUT = 600       # Seconds a search without a time limit may take before its worker is given up on
+# TCP keepalive: a worker host that disappears without closing the connection is noticed after about
+# KEEPALIVE_IDLE + KEEPALIVE_INTERVAL * KEEPALIVE_PROBES seconds, even while its search is still running
+KEEPALIVE_IDLE = 10
+KEEPALIVE_INTERVAL = 5
+KEEPALIVE_PROBES = 3
+MAX_RETRIES = 3     # Times a job is sent again after its worker failed
+MAX_CONNECT_FAILURES = 5        # Failed connections in a row before a worker is given up on
+RECONNECT_DELAY = 0.5       # Seconds, multiplied by the number of failures in a row
+
+def search_job(snapshot, algo_type, depth, time_limit):
+    """
+    Search a snapshot the way a worker does. Returns the id of the best move (0 if there is none), its score
+    for the player to move (nan if the algorithm doesn't compute one), the nodes searched and the time taken
+    """
+    gs = chess_engine.GameState.from_snapshot(snapshot)
+    ai.DEPTH = ai.MAX_DEPTH = ai.MULTI_PV_DEPTH = depth
+    ai.TIME_LIMIT = time_limit
+    ai.reset_counters()
+    start_time = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):     # Hide the counters find_best_move prints
+        best_move = ai.find_best_move(gs, gs.get_valid_moves(), algo_type)
+    score = math.nan if ai.next_move_score is None else ai.next_move_score
+    return best_move.move_id if best_move is not None else 0, score, ai.count_nodes(), \
+        time.perf_counter() - start_time
+
+class WorkerHandler(socketserver.StreamRequestHandler):
+    """
+    Serves one coordinator: answers its requests one at a time until it disconnects
+    """
+    def handle(self):
+        self.wfile.write(PROTOCOL_MAGIC)
+        self.wfile.flush()
+        while True:
+            request = self.rfile.read(REQUEST_SIZE)
+            if len(request) < REQUEST_SIZE:     # The coordinator is gone
+                return
+            job_id, algo_type, depth, time_limit = REQUEST_FORMAT.unpack_from(request)
+            try:
+                move_id, score, nodes, search_time = search_job(request[REQUEST_FORMAT.size:], algo_type, depth, \
+                    time_limit)
+                result = RESULT_FORMAT.pack(job_id, RESULT_OK, move_id, score, nodes, search_time)
+            except Exception as error:      # pylint: disable=broad-except
+                print(f"Job {job_id} failed: {error!r}")
+                result = RESULT_FORMAT.pack(job_id, RESULT_ERROR, 0, math.nan, 0, 0)
+            self.wfile.write(result)
+            self.wfile.flush()
+
+class WorkerServer(socketserver.TCPServer):
+    allow_reuse_address = True
+
+def serve(host, port, ready_queue=None):
+    """
+    Run a worker on host:port until it's stopped. The port it listens on (useful with port 0) is put in
+    ready_queue if one is given
+    """
+    with WorkerServer((host, port), WorkerHandler) as server:
+        if ready_queue is not None:
+            ready_queue.put(server.server_address[1])
+        else:
+            print(f"Worker listening on {server.server_address[0]}:{server.server_address[1]}")
+        server.serve_forever()
+
+class Coordinator():
+    """
+    Sends search jobs to the workers at addresses ((host, port) pairs) and collects the results. A job without a
+    time limit whose worker hasn't answered after job_timeout seconds (None for no limit) is sent again
+    """
+    def __init__(self, addresses, max_retries=MAX_RETRIES, job_timeout=JOB_TIMEOUT):
+        self.addresses = addresses
+        self.max_retries = max_retries
+        self.job_timeout = job_timeout
+        self.worker_stats = {f"{host}:{port}": {"jobs": 0, "nodes": 0, "search_time": 0.0, "failures": 0} \
+            for host, port in addresses}
+        self.retries = 0
+        self.elapsed = 0.0
+
+    async def analyze(self, jobs):
+        """
+        Run the jobs, (snapshot, algo_type, depth, time_limit) tuples, and return a result for each of them in
+        the same order: (move_id, score, nodes, search_time) or None if it failed on every try
+        """
+        start_time = time.perf_counter()
+        self.queue = asyncio.Queue()
+        for job_id in range(len(jobs)):
+            self.queue.put_nowait((job_id, 0))
+        self.jobs = jobs
+        self.results = [None] * len(jobs)
+        self.unfinished = len(jobs)
+        self.all_finished = asyncio.Event()
+        if not jobs:
+            self.all_finished.set()
+        workers = [asyncio.create_task(self.run_worker(host, port)) for host, port in self.addresses]
+        finished = asyncio.create_task(self.all_finished.wait())
+        # Done when every job is finished, or when every worker has been given up on
+        pending = set(workers) | {finished}
+        while finished in pending and pending - {finished}:
+            _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        self.elapsed = time.perf_counter() - start_time
+        return self.results
+
+    def finish_job(self, job_id, result):
+        self.results[job_id] = result
+        self.unfinished -= 1
+        if self.unfinished == 0:
+            self.all_finished.set()
+
+    async def run_worker(self, host, port):
+        """
+        Keep one worker busy with jobs from the queue, reconnecting when the connection fails
+        """
+        stats = self.worker_stats[f"{host}:{port}"]
+        connect_failures = 0
+        while True:
+            try:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), CONNECT_TIMEOUT)
+                if await asyncio.wait_for(reader.readexactly(len(PROTOCOL_MAGIC)), CONNECT_TIMEOUT) != PROTOCOL_MAGIC:
+                    writer.close()
+                    raise ConnectionError(f"{host}:{port} isn't a chess worker")
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as error:
+                connect_failures += 1
+                stats["failures"] += 1
+                if connect_failures >= MAX_CONNECT_FAILURES:
+                    print(f"Giving up on worker {host}:{port}: {error!r}")
+                    return
+                await asyncio.sleep(RECONNECT_DELAY * connect_failures)
+                continue
+            connect_failures = 0
+            enable_keepalive(writer.get_extra_info("socket"))
+            job_id = None
+            try:
+                while True:
+                    job_id, attempts = await self.queue.get()
+                    snapshot, algo_type, depth, time_limit = self.jobs[job_id]
+                    writer.write(REQUEST_FORMAT.pack(job_id, algo_type, depth, time_limit) + snapshot)
+                    await writer.drain()
+                    timeout = time_limit + JOB_TIMEOUT_GRACE if algo_type == 6 and time_limit != math.inf \
+                        else self.job_timeout
+                    result = RESULT_FORMAT.unpack(await asyncio.wait_for(reader.readexactly(RESULT_FORMAT.size), \
+                        timeout))
+                    if result[0] != job_id:
+                        raise ConnectionError(f"{host}:{port} answered job {result[0]} instead of {job_id}")
+                    if result[1] != RESULT_OK:      # The worker is fine but can't search this job, don't retry it
+                        self.finish_job(job_id, None)
+                    else:
+                        stats["jobs"] += 1
+                        stats["nodes"] += result[4]
+                        stats["search_time"] += result[5]
+                        self.finish_job(job_id, result[2:])
+                    job_id = None
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as error:
+                stats["failures"] += 1
+                print(f"Worker {host}:{port} failed: {error!r}")
+                if job_id is not None:
+                    if attempts < self.max_retries:
+                        self.retries += 1
+                        self.queue.put_nowait((job_id, attempts + 1))
+                    else:
+                        self.finish_job(job_id, None)
+            finally:
+                writer.close()
+
+    def get_metrics(self):
+        """
+        Throughput of the last analyze() call, overall and for each worker
+        """
+        jobs = sum(stats["jobs"] for stats in self.worker_stats.values())
+        nodes = sum(stats["nodes"] for stats in self.worker_stats.values())
+        return {
+            "workers": len(self.addresses),
+            "jobs_completed": jobs,
+            "jobs_failed": sum(result is None for result in self.results),
+            "retries": self.retries,
+            "elapsed": self.elapsed,
+            "jobs_per_second": jobs / self.elapsed if self.elapsed else 0.0,
+            "nodes_per_second": nodes / self.elapsed if self.elapsed else 0.0,
+            "worker_stats": self.worker_stats,
+        }
+
+def enable_keepalive(sock):
+    """
+    Turn on TCP keepalive, with shorter timings than the system's (hours) where the platform lets them be set
+    """
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    for option, value in (("TCP_KEEPIDLE", KEEPALIVE_IDLE), ("TCP_KEEPINTVL", KEEPALIVE_INTERVAL), \
+            ("TCP_KEEPCNT", KEEPALIVE_PROBES)):
+        if hasattr(socket, option):
+            sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+
+def load_jobs(pgn_path, max_positions, algo_type, depth, time_limit):
+    """
+    The positions to analyze: every position of the games in the PGN file, or the benchmark positions
+    """
+    snapshots = []
+    if pgn_path:
+        for game in chess_pgn.read_games_from_path(pgn_path):
+            try:
+                for gs, _ in game.replay():
+                    if max_positions and len(snapshots) >= max_positions:
+                        break
+                    snapshots.append(gs.get_snapshot())
+            except ValueError as error:
+                print("Skipping the rest of a game:", error)
+            if max_positions and len(snapshots) >= max_positions:
+                break
+    else:
+        snapshots = [chess_benchmark.load_position(moves).get_snapshot() for _, moves in \
+            chess_benchmark.BENCHMARK_POSITIONS]
+    return [(snapshot, algo_type, depth, time_limit) for snapshot in snapshots]
+
+def run_coordinator(addresses, args):
+    jobs = load_jobs(args.pgn, args.max_positions, args.algo, args.depth, args.time_limit)
+    coordinator = Coordinator(addresses, args.max_retries, args.job_timeout or None)
+    results = asyncio.run(coordinator.analyze(jobs))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            for job_id, ((snapshot, _, _, _), result) in enumerate(zip(jobs, results)):
+                record = {"job": job_id, "snapshot": snapshot.hex(), "move": None, "score": None, "nodes": None}
+                if result is not None:
+                    move_id, score, nodes, _ = result
+                    gs = chess_engine.GameState.from_snapshot(snapshot)
+                    move = next((move for move in gs.get_valid_moves() if move.move_id == move_id), None)
+                    record.update(move=str(move) if move else None, score=None if math.isnan(score) else score, \
+                        nodes=nodes)
+                output_file.write(json.dumps(record) + "\n")
+    metrics = coordinator.get_metrics()
+    for name, value in metrics.items():
+        if name != "worker_stats":
+            print(f"{name}: {value:.3f}" if isinstance(value, float) else f"{name}: {value}")
+    for address, stats in metrics["worker_stats"].items():
+        print(f"  {address}: {stats['jobs']} jobs, {stats['nodes']} nodes, {stats['search_time']:.2f}s searching, " \
+            f"{stats['failures']} failures")
+    return 1 if metrics["jobs_failed"] else 0
+
+def parse_address(text):
+    host, _, port = text.rpartition(":")
+    return host or "localhost", int(port)
+
+def main():
+    parser = argparse.ArgumentParser(description="Distributed analysis over TCP")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    worker_parser = subparsers.add_parser("worker", help="search the positions coordinators send")
+    worker_parser.add_argument("--host", default=DEFAULT_HOST, help="address to listen on (default: " \
+        f"{DEFAULT_HOST}). Workers have no authentication, so only listen where every host that can connect is trusted")
+    worker_parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    coordinate_parser = subparsers.add_parser("coordinate", help="analyze positions on running workers")
+    coordinate_parser.add_argument("--workers", nargs="+", required=True, help="host:port of each worker")
+    local_parser = subparsers.add_parser("local", help="start workers on localhost and analyze positions on them")
+    local_parser.add_argument("--processes", type=int, default=multiprocessing.cpu_count())
+    for job_parser in (coordinate_parser, local_parser):
+        job_parser.add_argument("--pgn", help="analyze every position of these games (default: benchmark positions)")
+        job_parser.add_argument("--max-positions", type=int, default=None)
+        job_parser.add_argument("--algo", type=int, default=DEFAULT_ALGO_TYPE, help="algo_type of the search")
+        job_parser.add_argument("--depth", type=int, default=DEFAULT_DEPTH)
+        job_parser.add_argument("--time-limit", type=float, default=DEFAULT_TIME_LIMIT, \
+            help="seconds per position for the iterative deepening search")
+        job_parser.add_argument("--max-retries", type=int, default=MAX_RETRIES)
+        job_parser.add_argument("--job-timeout", type=float, default=JOB_TIMEOUT, \
+            help="seconds a search without a time limit may take before it's sent to another worker (0: no limit)")
+        job_parser.add_argument("--output", help="JSON lines file for the results")
+    args = parser.parse_args()
+
+    if args.command == "worker":
+        serve(args.host, args.port)
+        return 0
+    if args.command == "coordinate":
+        return run_coordinator([parse_address(address) for address in args.workers], args)
+    ready_queue = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=serve, args=("127.0.0.1", 0, ready_queue), daemon=True) \
+        for _ in range(args.processes)]
+    for worker in workers:
+        worker.start()
+    addresses = [("127.0.0.1", ready_queue.get()) for _ in workers]
+    try:
+        return run_coordinator(addresses, args)
+    finally:
+        for worker in workers:
+            worker.terminate()
+
+# Best practice to ensure the function only runs when the file is run directly
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,63 @@
 import copy
+import random
+import struct
+
+PIECE_TYPES = ("P", "R", "N", "B", "Q", "K")
+PIECES = tuple(color + piece_type for color in "wb" for piece_type in PIECE_TYPES)
+
+# Zobrist hashing: a random 64-bit number for every piece on every square, for black to move, for each castling
+# right and for each enpassant column. XORing together the numbers of a position gives its hash.
+# The generator is seeded so that every process (and every run) agrees on the hashes
+zobrist_random = random.Random(20210815)
+ZOBRIST_PIECES = {piece: [[zobrist_random.getrandbits(64) for c in range(8)] for r in range(8)] for piece in PIECES}
+ZOBRIST_BLACK_TO_MOVE = zobrist_random.getrandbits(64)
+ZOBRIST_CASTLING = [zobrist_random.getrandbits(64) for i in range(4)]     # wks, bks, wqs, bqs
+ZOBRIST_ENPASSANT = [zobrist_random.getrandbits(64) for c in range(8)]
+
+# Snapshots: a fixed-size bytes form of a position (board, side to move, castling rights, enpassant square
+# and hash), so handing a position to another process doesn't cost more as the game gets longer
+SNAPSHOT_PIECES = ("--",) + PIECES
+SNAPSHOT_PIECE_CODES = {piece: code for code, piece in enumerate(SNAPSHOT_PIECES)}
+SNAPSHOT_FORMAT = struct.Struct("<64s?BbQ")     # board, white to move, castling bits, enpassant square (-1 if none), hash
+SNAPSHOT_SIZE = SNAPSHOT_FORMAT.size
+
+# Move generation tables, built once at import so the move generators don't have to check the board edges.
+# For each square (r, c): the squares a knight or king on it can move to, the squares a pawn on it attacks,
+# and the rays a sliding piece can move along, each ray ordered from the nearest square outwards
+KNIGHT_DIRECTIONS = ((-2, 1), (-1, 2), (1, 2), (2, 1), (2, -1), (1, -2), (-1, -2), (-2, -1))
+KING_DIRECTIONS = ((-1, 0), (0, 1), (1, 0), (0, -1), (-1, 1), (1, 1), (1, -1), (-1, -1))
+ROOK_DIRECTIONS = ((-1, 0), (0, 1), (1, 0), (0, -1))
+BISHOP_DIRECTIONS = ((-1, 1), (1, 1), (1, -1), (-1, -1))
+
+def build_targets(directions):
+    """
+    For each square, the squares one step away in each direction that are still on the board
+    """
+    return [[tuple((r + d_r, c + d_c) for d_r, d_c in directions if 0 <= r + d_r <= 7 and 0 <= c + d_c <= 7) \
+        for c in range(8)] for r in range(8)]
+
+def build_rays(directions):
+    """
+    For each square, the squares in each direction up to the edge of the board. Empty rays are left out
+    """
+    rays = [[[] for c in range(8)] for r in range(8)]
+    for r in range(8):
+        for c in range(8):
+            for d_r, d_c in directions:
+                ray = tuple((r + d_r*i, c + d_c*i) for i in range(1, 8) \
+                    if 0 <= r + d_r*i <= 7 and 0 <= c + d_c*i <= 7)
+                if ray:
+                    rays[r][c].append(ray)
+    return [[tuple(square_rays) for square_rays in row] for row in rays]
+
+KNIGHT_TARGETS = build_targets(KNIGHT_DIRECTIONS)
+KING_TARGETS = build_targets(KING_DIRECTIONS)
+WHITE_PAWN_ATTACKS = build_targets(((-1, -1), (-1, 1)))
+BLACK_PAWN_ATTACKS = build_targets(((1, -1), (1, 1)))
+ROOK_RAYS = build_rays(ROOK_DIRECTIONS)
+BISHOP_RAYS = build_rays(BISHOP_DIRECTIONS)
+QUEEN_RAYS = [[ROOK_RAYS[r][c] + BISHOP_RAYS[r][c] for c in range(8)] for r in range(8)]
+
 class GameState():
     """
     This class is responsible for storing all the information about the current state of a chess game.
@@ -45,6 +104,11 @@ class GameState():
         self.castle_rights_log = [CastleRights(self.current_castling_right.wks, \
             self.current_castling_right.bks, self.current_castling_right.wqs, \
                 self.current_castling_right.bqs)]
+        self.piece_squares = self.find_piece_squares()   # For each piece, the set of squares it's on
+        self.zobrist_key = self.compute_zobrist_key()
+        self.zobrist_log = [self.zobrist_key]
+        self.pawn_key = self.compute_pawn_key()     # Hash of the pawns alone, for caching the pawn structure
+        self.pawn_key_log = [self.pawn_key]
 
     def make_move(self, move):
         """
@@ -63,7 +127,7 @@ class GameState():
 
         # Pawn promotion
         if move.is_pawn_promotion:
-            self.board[move.end_row][move.end_col] = move.piece_moved[0] + 'Q' # Color + Piece
+            self.board[move.end_row][move.end_col] = move.piece_moved[0] + move.promotion_choice # Color + Piece
 
         # Enpassant
         if move.is_enpassant_move:
@@ -82,7 +146,18 @@ class GameState():
             else:       # Queen's side castle
                 self.board[move.end_row][move.end_col+1] = self.board[move.end_row][move.end_col-2] # Copies the rook into its new square
                 self.board[move.end_row][move.end_col-2] = '--' # Remove the rook from its position
-            
+        # Update the piece lists
+        self.piece_squares[move.piece_moved].remove((move.start_row, move.start_col))
+        if move.is_capture_move:
+            captured_row = move.start_row if move.is_enpassant_move else move.end_row
+            self.piece_squares[move.piece_captured].remove((captured_row, move.end_col))
+        self.piece_squares[self.board[move.end_row][move.end_col]].add((move.end_row, move.end_col))
+        if move.is_castle_move:
+            rook_start_col, rook_end_col = (7, 5) if move.end_col - move.start_col == 2 else (0, 3)
+            rook_squares = self.piece_squares[move.piece_moved[0] + 'R']
+            rook_squares.remove((move.end_row, rook_start_col))
+            rook_squares.add((move.end_row, rook_end_col))
+
         # Update enpassant rights
         self.enpassant_log.append(self.enpassant_possible)
         # Update Castling Rights - whenever a rook or a king moves
@@ -90,8 +165,30 @@ class GameState():
         self.castle_rights_log.append(CastleRights(self.current_castling_right.wks, \
             self.current_castling_right.bks, self.current_castling_right.wqs, \
                 self.current_castling_right.bqs))
-
-
+        # Update the hash with only what the move changed
+        key = self.zobrist_key ^ ZOBRIST_BLACK_TO_MOVE
+        key ^= ZOBRIST_PIECES[move.piece_moved][move.start_row][move.start_col]
+        key ^= ZOBRIST_PIECES[self.board[move.end_row][move.end_col]][move.end_row][move.end_col]  # Promoted piece if any
+        if move.is_capture_move:
+            key ^= ZOBRIST_PIECES[move.piece_captured][captured_row][move.end_col]
+        if move.is_castle_move:
+            rook = move.piece_moved[0] + 'R'
+            key ^= ZOBRIST_PIECES[rook][move.end_row][rook_start_col] ^ ZOBRIST_PIECES[rook][move.end_row][rook_end_col]
+        key ^= zobrist_enpassant_key(self.enpassant_log[-2]) ^ zobrist_enpassant_key(self.enpassant_possible)
+        key ^= zobrist_castling_key(self.castle_rights_log[-2]) ^ zobrist_castling_key(self.current_castling_right)
+        self.zobrist_key = key
+        self.zobrist_log.append(key)
+        # Only pawn moves and pawn captures change the pawn hash
+        if move.piece_moved[1] == 'P' or move.piece_captured[1] == 'P':
+            pawn_key = self.pawn_key
+            if move.piece_moved[1] == 'P':
+                pawn_key ^= ZOBRIST_PIECES[move.piece_moved][move.start_row][move.start_col]
+                if not move.is_pawn_promotion:
+                    pawn_key ^= ZOBRIST_PIECES[move.piece_moved][move.end_row][move.end_col]
+            if move.piece_captured[1] == 'P':
+                pawn_key ^= ZOBRIST_PIECES[move.piece_captured][captured_row][move.end_col]
+            self.pawn_key = pawn_key
+        self.pawn_key_log.append(self.pawn_key)
 
     def undo_move(self):
         """
@@ -99,6 +196,17 @@ class GameState():
         """
         if self.move_log:      # Make sure there's at least one move played
             move = self.move_log.pop()
+            # Undo the piece lists
+            self.piece_squares[self.board[move.end_row][move.end_col]].remove((move.end_row, move.end_col))
+            self.piece_squares[move.piece_moved].add((move.start_row, move.start_col))
+            if move.is_capture_move:
+                captured_row = move.start_row if move.is_enpassant_move else move.end_row
+                self.piece_squares[move.piece_captured].add((captured_row, move.end_col))
+            if move.is_castle_move:
+                rook_start_col, rook_end_col = (7, 5) if move.end_col - move.start_col == 2 else (0, 3)
+                rook_squares = self.piece_squares[move.piece_moved[0] + 'R']
+                rook_squares.remove((move.end_row, rook_end_col))
+                rook_squares.add((move.end_row, rook_start_col))
             self.board[move.start_row][move.start_col] = move.piece_moved
             self.board[move.end_row][move.end_col] = move.piece_captured
             self.white_to_move = not self.white_to_move
@@ -118,6 +226,11 @@ class GameState():
             self.castle_rights_log.pop()
             castle_rights = copy.deepcopy(self.castle_rights_log[-1])
             self.current_castling_right = castle_rights
+            # Undo hash
+            self.zobrist_log.pop()
+            self.zobrist_key = self.zobrist_log[-1]
+            self.pawn_key_log.pop()
+            self.pawn_key = self.pawn_key_log[-1]
             # Undo castle move
             if move.is_castle_move:
                 if move.end_col - move.start_col == 2:      # King's side castle
@@ -127,7 +240,172 @@ class GameState():
                     self.board[move.end_row][move.end_col-2] = self.board[move.end_row][move.end_col+1] # Move the rook back to its position
                     self.board[move.end_row][move.end_col+1] = '--' # Empties the rook's square
             self.check_mate = self.stale_mate = False
-            
+
+    def make_null_move(self):
+        """
+        Pass the turn to the opponent without moving a piece (used by null move pruning in the search).
+        The null move isn't logged in the move log, so it has to be undone with undo_null_move()
+        """
+        self.white_to_move = not self.white_to_move
+        self.zobrist_key ^= ZOBRIST_BLACK_TO_MOVE ^ zobrist_enpassant_key(self.enpassant_possible)
+        self.zobrist_log.append(self.zobrist_key)
+        self.enpassant_possible = ()     # A pass always forfeits the enpassant capture
+        self.enpassant_log.append(self.enpassant_possible)
+        self.castle_rights_log.append(CastleRights(self.current_castling_right.wks, \
+            self.current_castling_right.bks, self.current_castling_right.wqs, \
+                self.current_castling_right.bqs))
+
+    def undo_null_move(self):
+        """
+        Undo the last null move
+        """
+        self.white_to_move = not self.white_to_move
+        self.enpassant_log.pop()
+        self.enpassant_possible = copy.deepcopy(self.enpassant_log[-1])
+        self.castle_rights_log.pop()
+        self.current_castling_right = copy.deepcopy(self.castle_rights_log[-1])
+        self.zobrist_log.pop()
+        self.zobrist_key = self.zobrist_log[-1]
+        self.check_mate = self.stale_mate = False
+
+    def compute_zobrist_key(self):
+        """
+        Compute the hash of the current position from scratch. make_move() and undo_move() keep
+        self.zobrist_key up to date incrementally, so this is only needed for new positions
+        """
+        key = 0 if self.white_to_move else ZOBRIST_BLACK_TO_MOVE
+        for piece, squares in self.piece_squares.items():
+            for r, c in squares:
+                key ^= ZOBRIST_PIECES[piece][r][c]
+        key ^= zobrist_enpassant_key(self.enpassant_possible)
+        key ^= zobrist_castling_key(self.current_castling_right)
+        return key
+
+    def compute_pawn_key(self):
+        """
+        Compute the hash of the pawns alone from scratch, kept up to date by make_move() and undo_move() like
+        self.zobrist_key. Positions with the same pawns have the same pawn key
+        """
+        key = 0
+        for piece in ('wP', 'bP'):
+            for r, c in self.piece_squares[piece]:
+                key ^= ZOBRIST_PIECES[piece][r][c]
+        return key
+
+    def get_snapshot(self):
+        """
+        Pack the current position into SNAPSHOT_SIZE bytes, which can be sent to another process and turned back
+        into a GameState with GameState.from_snapshot(). The move log isn't included
+        """
+        board = bytes(SNAPSHOT_PIECE_CODES[square] for row in self.board for square in row)
+        castling = self.current_castling_right.wks | self.current_castling_right.bks << 1 | \
+            self.current_castling_right.wqs << 2 | self.current_castling_right.bqs << 3
+        enpassant = self.enpassant_possible[0] * 8 + self.enpassant_possible[1] if self.enpassant_possible else -1
+        return SNAPSHOT_FORMAT.pack(board, self.white_to_move, castling, enpassant, self.zobrist_key)
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """
+        Create a GameState from bytes made by get_snapshot(). The game starts at the snapshot position,
+        so moves played before it can't be undone
+        """
+        if len(snapshot) != SNAPSHOT_SIZE:
+            raise ValueError(f"A snapshot is {SNAPSHOT_SIZE} bytes long, got {len(snapshot)}")
+        board, white_to_move, castling, enpassant, key = SNAPSHOT_FORMAT.unpack(snapshot)
+        gs = cls()
+        gs.board = [[SNAPSHOT_PIECES[code] for code in board[r*8:r*8 + 8]] for r in range(8)]
+        gs.piece_squares = gs.find_piece_squares()
+        for king_location in gs.piece_squares['wK']:
+            gs.white_king_location = king_location
+        for king_location in gs.piece_squares['bK']:
+            gs.black_king_location = king_location
+        gs.white_to_move = white_to_move
+        gs.enpassant_possible = divmod(enpassant, 8) if enpassant >= 0 else ()
+        gs.enpassant_log = [gs.enpassant_possible]
+        gs.current_castling_right = CastleRights(bool(castling & 1), bool(castling & 2), bool(castling & 4), \
+            bool(castling & 8))
+        gs.castle_rights_log = [CastleRights(gs.current_castling_right.wks, gs.current_castling_right.bks, \
+            gs.current_castling_right.wqs, gs.current_castling_right.bqs)]
+        gs.zobrist_key = key
+        gs.zobrist_log = [key]
+        gs.pawn_key = gs.compute_pawn_key()
+        gs.pawn_key_log = [gs.pawn_key]
+        return gs
+
+    @classmethod
+    def from_fen(cls, fen):
+        """
+        Create a GameState from a FEN (Forsyth-Edwards Notation) string, e.g. the FEN tag of a PGN puzzle.
+        The move counters are ignored, and a castling right whose king or rook isn't on its starting square is
+        dropped. Raises ValueError if the FEN can't be read
+        """
+        fields = fen.split()
+        if len(fields) < 4:
+            raise ValueError(f"Can't read the FEN {fen}: it needs the board, side to move, castling and enpassant")
+        ranks = fields[0].split("/")
+        board = []
+        for rank in ranks:
+            row = []
+            for symbol in rank:
+                if symbol in "12345678":
+                    row += ["--"] * int(symbol)
+                elif symbol.upper() in PIECE_TYPES:
+                    row.append(("w" if symbol.isupper() else "b") + symbol.upper())
+                else:
+                    raise ValueError(f"Can't read the FEN {fen}: {symbol} isn't a piece")
+            board.append(row)
+        if len(board) != 8 or any(len(row) != 8 for row in board):
+            raise ValueError(f"Can't read the FEN {fen}: the board isn't 8x8")
+        if fields[1] not in ("w", "b") or fields[2] != "-" and set(fields[2]) - set("KQkq"):
+            raise ValueError(f"Can't read the FEN {fen}: bad side to move or castling rights")
+        gs = cls()
+        gs.board = board
+        gs.piece_squares = gs.find_piece_squares()
+        if len(gs.piece_squares['wK']) != 1 or len(gs.piece_squares['bK']) != 1:
+            raise ValueError(f"Can't read the FEN {fen}: each side needs exactly one king")
+        gs.white_king_location, = gs.piece_squares['wK']
+        gs.black_king_location, = gs.piece_squares['bK']
+        gs.white_to_move = fields[1] == "w"
+        if fields[3] == "-":
+            gs.enpassant_possible = ()
+        elif len(fields[3]) == 2 and fields[3][0] in Move.files_to_cols and fields[3][1] in ("3", "6"):
+            gs.enpassant_possible = (Move.ranks_to_rows[fields[3][1]], Move.files_to_cols[fields[3][0]])
+        else:
+            raise ValueError(f"Can't read the FEN {fen}: {fields[3]} isn't an enpassant square")
+        gs.enpassant_log = [gs.enpassant_possible]
+        castling = fields[2]
+        gs.current_castling_right = CastleRights( \
+            "K" in castling and board[7][4] == "wK" and board[7][7] == "wR", \
+            "k" in castling and board[0][4] == "bK" and board[0][7] == "bR", \
+            "Q" in castling and board[7][4] == "wK" and board[7][0] == "wR", \
+            "q" in castling and board[0][4] == "bK" and board[0][0] == "bR")
+        gs.castle_rights_log = [CastleRights(gs.current_castling_right.wks, gs.current_castling_right.bks, \
+            gs.current_castling_right.wqs, gs.current_castling_right.bqs)]
+        gs.zobrist_key = gs.compute_zobrist_key()
+        gs.zobrist_log = [gs.zobrist_key]
+        gs.pawn_key = gs.compute_pawn_key()
+        gs.pawn_key_log = [gs.pawn_key]
+        return gs
+
+    def find_piece_squares(self):
+        """
+        Scan the board for the squares of each piece. make_move() and undo_move() keep self.piece_squares
+        up to date afterwards, so the board doesn't have to be scanned again
+        """
+        piece_squares = {piece: set() for piece in PIECES}
+        for r, row in enumerate(self.board):
+            for c, square in enumerate(row):
+                if square != "--":
+                    piece_squares[square].add((r, c))
+        return piece_squares
+
+    def has_non_pawn_material(self):
+        """
+        Determine if the current player has any piece other than pawns and the king
+        """
+        turn = 'w' if self.white_to_move else 'b'
+        return any(self.piece_squares[turn + piece_type] for piece_type in "NBRQ")
+
     def update_castle_rights(self, move):
         """
         Update castling rights based on king and rook moves
@@ -231,213 +509,91 @@ class GameState():
         All moves not considering checks
         """
         moves = []
+        turn = 'w' if self.white_to_move else 'b'
+        # Only visit the squares that have the current player's pieces on them
         # pylint: disable=locally-disabled, invalid-name
-        for r, _ in enumerate(self.board):
-            for c, _ in enumerate(self.board[r]):
-                turn = self.board[r][c][0]
-                if(turn == 'w' and self.white_to_move) or (turn == 'b' and not self.white_to_move):
-                    piece = self.board[r][c][1]
-                    self.move_functions[piece](r, c, moves)
+        for piece_type in PIECE_TYPES:
+            for r, c in self.piece_squares[turn + piece_type]:
+                self.move_functions[piece_type](r, c, moves)
         return moves
 
     # pylint: disable=locally-disabled, invalid-name
-    def get_pawn_moves(self, r, c, moves):       
+    def get_pawn_moves(self, r, c, moves):
         """
         Get all possible moves for the pawn located at (r, w) and add them the list of all
         possible moves
         """
         if self.white_to_move: # White pawn moves
-            if self.board[r-1][c] == "--": # 1 square pawn advance
-                moves.append(Move((r,c), (r-1, c), self.board))
-                if r == 6 and self.board[r-2][c] == "--": # 2 square pawn advance
-                    moves.append(Move((r,c), (r-2, c), self.board))
-            if c-1 >= 0: # Captures to the left
-                if self.board[r-1][c-1][0] == 'b': 
-                    moves.append(Move((r,c), (r-1, c-1), self.board))
-                elif (r-1, c-1) == self.enpassant_possible:
-                    moves.append(Move((r,c), (r-1, c-1), self.board, is_enpassant_move = True)) # Setting the optional parameter
-            if c+1 <= 7: # Captures to the left
-                if self.board[r-1][c+1][0] == 'b':
-                    moves.append(Move((r,c), (r-1, c+1), self.board))
-                elif (r-1, c+1) == self.enpassant_possible:
-                    moves.append(Move((r,c), (r-1, c+1), self.board, is_enpassant_move = True)) # Setting the optional parameter
-
-        if not self.white_to_move: # Black pawn moves
-            if self.board[r+1][c] == "--": # 1 square pawn advance
-                moves.append(Move((r,c), (r+1, c), self.board))
-                if r == 1 and self.board[r+2][c] == "--": # 2 square pawn advance
-                    moves.append(Move((r,c), (r+2, c), self.board))
-            if c-1 >= 0: # Captures to the left
-                if self.board[r+1][c-1][0] == 'w':
-                    moves.append(Move((r,c), (r+1, c-1), self.board))
-                elif (r+1, c-1) == self.enpassant_possible:
-                    moves.append(Move((r,c), (r+1, c-1), self.board, is_enpassant_move = True)) # Setting the optional parameter
-
-            if c+1 <= 7: # Captures to the left
-                if self.board[r+1][c+1][0] == 'w':
-                    moves.append(Move((r,c), (r+1, c+1), self.board))
-                elif (r+1, c+1) == self.enpassant_possible:
-                    moves.append(Move((r,c), (r+1, c+1), self.board, is_enpassant_move = True)) # Setting the optional parameter
+            direction, start_row, enemy, attacks = -1, 6, 'b', WHITE_PAWN_ATTACKS[r][c]
+        else: # Black pawn moves
+            direction, start_row, enemy, attacks = 1, 1, 'w', BLACK_PAWN_ATTACKS[r][c]
+        if self.board[r+direction][c] == "--": # 1 square pawn advance
+            moves.append(Move((r,c), (r+direction, c), self.board))
+            if r == start_row and self.board[r+2*direction][c] == "--": # 2 square pawn advance
+                moves.append(Move((r,c), (r+2*direction, c), self.board))
+        for end_sq in attacks: # Captures to the left and to the right
+            if self.board[end_sq[0]][end_sq[1]][0] == enemy:
+                moves.append(Move((r,c), end_sq, self.board))
+            elif end_sq == self.enpassant_possible:
+                moves.append(Move((r,c), end_sq, self.board, is_enpassant_move = True)) # Setting the optional parameter
+
     # pylint: disable=locally-disabled, invalid-name
     def get_rook_moves(self, r, c, moves):
         """
         Get all possible moves for the rock located at (r, w) and add them the list of all
         possible moves
         """
-        top = right = down = left = True
-        for i in range(1, 8):
-            if top and r - i >= 0:      # There were no obstacles top or end of the board
-                if self.board[r-i][c] == '--':
-                    moves.append(Move((r,c), (r-i,c), self.board))
-                elif self.board[r-i][c][0] != self.board[r][c][0]:      # If it's an enemy piece
-                    # Capture it and don't look for movre moves
-                    moves.append(Move((r,c), (r-i,c), self.board))
-                    top = False
-                else:
-                    top = False
-            if right and c + i <= 7:
-                if self.board[r][c+i] == '--':
-                    moves.append(Move((r,c), (r,c+i), self.board))
-                elif self.board[r][c+i][0] != self.board[r][c][0]:      # If it's an enemy piece
-                    moves.append(Move((r,c), (r,c+i), self.board))
-                    right = False
-                else:
-                    right = False
-            if down and r + i <= 7:
-                if self.board[r+i][c] == '--':
-                    moves.append(Move((r,c), (r+i,c), self.board))
-                elif self.board[r+i][c][0] != self.board[r][c][0]:      # If it's an enemy piece
-                    # Capture it and don't look for movre moves
-                    moves.append(Move((r,c), (r+i,c), self.board)) 
-                    down = False
-                else:
-                    down = False
-            if left and c - i >= 0:
-                if self.board[r][c-i] == '--':
-                    moves.append(Move((r,c), (r,c-i), self.board))
-                elif self.board[r][c-i][0] != self.board[r][c][0]:      # If it's an enemy piece
-                    moves.append(Move((r,c), (r,c-i), self.board))
-                    left = False
-                else:
-                    left = False
-                    
+        self.get_sliding_moves(r, c, ROOK_RAYS[r][c], moves)
+
     def get_knight_moves(self, r, c, moves):
         """
         Get all possible moves for the knight located at (r, w) and add them the list of all
         possible moves
         """
-        if r - 2 >= 0 and c + 1 <= 7:      # There were no obstacles top or end of the board
-            if self.board[r-2][c+1][0] != self.board[r][c][0]:      # If it's an enemy piece pr empty
-                # Capture it and don't look for movre moves
-                moves.append(Move((r,c), (r-2,c+1), self.board))
-        if c + 2 <= 7 and r - 1 >= 0:
-            if self.board[r-1][c+2][0] != self.board[r][c][0]:      # If it's an enemy piece pr empty
-                moves.append(Move((r,c), (r-1,c+2), self.board))
-        if c + 2 <= 7 and r + 1 <= 7:
-            if self.board[r+1][c+2][0] != self.board[r][c][0]:      # If it's an enemy piece pr empty
-                # Capture it and don't look for movre moves
-                moves.append(Move((r,c), (r+1,c+2), self.board)) 
-        if  c + 1 <= 7 and r + 2 <= 7:
-            if self.board[r+2][c+1][0] != self.board[r][c][0]:      # If it's an enemy piece pr empty
-                moves.append(Move((r,c), (r+2,c+1), self.board))
-        if r + 2 <= 7 and c - 1 >= 0:      # There were no obstacles top or end of the board
-            if self.board[r+2][c-1][0] != self.board[r][c][0]:      # If it's an enemy piece
-                # Capture it and don't look for movre moves
-                moves.append(Move((r,c), (r+2,c-1), self.board))
-        if c - 2 >= 0 and r + 1 <= 7:
-            if self.board[r+1][c-2][0] != self.board[r][c][0]:      # If it's an enemy piece
-                moves.append(Move((r,c), (r+1,c-2), self.board))
-        if r - 1 >= 0 and c - 2 >= 0:
-            if self.board[r-1][c-2][0] != self.board[r][c][0]:      # If it's an enemy piece
-                # Capture it and don't look for movre moves
-                moves.append(Move((r,c), (r-1,c-2), self.board)) 
-        if c - 1 >= 0 and r - 2 >= 0:
-            if self.board[r-2][c-1][0] != self.board[r][c][0]:      # If it's an enemy piece
-                moves.append(Move((r,c), (r-2,c-1), self.board))
+        ally = self.board[r][c][0]
+        for end_row, end_col in KNIGHT_TARGETS[r][c]:
+            if self.board[end_row][end_col][0] != ally:      # If it's an enemy piece or empty
+                moves.append(Move((r,c), (end_row,end_col), self.board))
+
     def get_bishop_moves(self, r, c, moves):
         """
         Get all possible moves for the bishop located at (r, w) and add them the list of all
         possible moves
         """
-        top_right = down_right = down_left = top_left = True
-        for i in range(1, 8):
-            if top_right and r - i >= 0 and c + i <= 7:      # There were no obstacles top or end of the board
-                if self.board[r-i][c+i] == '--':
-                    moves.append(Move((r,c), (r-i,c+i), self.board))
-                elif self.board[r-i][c+i][0] != self.board[r][c][0]:      # If it's an enemy piece
-                    # Capture it and don't look for movre moves
-                    moves.append(Move((r,c), (r-i,c+i), self.board))
-                    top_right = False
-                else:
-                    top_right = False
-            if down_right and c + i <= 7 and r + i <= 7:
-                if self.board[r+i][c+i] == '--':
-                    moves.append(Move((r,c), (r+i,c+i), self.board))
-                elif self.board[r+i][c+i][0] != self.board[r][c][0]:      # If it's an enemy piece
-                    moves.append(Move((r,c), (r+i,c+i), self.board))
-                    down_right = False
-                else:
-                    down_right = False
-            if down_left and r + i <= 7 and c - i >= 0:
-                if self.board[r+i][c-i] == '--':
-                    moves.append(Move((r,c), (r+i,c-i), self.board))
-                elif self.board[r+i][c-i][0] != self.board[r][c][0]:      # If it's an enemy piece
-                    # Capture it and don't look for movre moves
-                    moves.append(Move((r,c), (r+i,c-i), self.board)) 
-                    down_left = False
-                else:
-                    down_left = False
-            if top_left and c - i >= 0 and r - i >= 0:
-                if self.board[r-i][c-i] == '--':
-                    moves.append(Move((r,c), (r-i,c-i), self.board))
-                elif self.board[r-i][c-i][0] != self.board[r][c][0]:      # If it's an enemy piece
-                    moves.append(Move((r,c), (r-i,c-i), self.board))
-                    top_left = False
-                else:
-                    top_left = False
-                    
+        self.get_sliding_moves(r, c, BISHOP_RAYS[r][c], moves)
+
     def get_queen_moves(self, r, c, moves):
         """
         Get all possible moves for the queen located at (r, w) and add them the list of all
         possible moves
         """
-        self.get_rook_moves(r, c, moves)
-        self.get_bishop_moves(r, c, moves)
-        
+        self.get_sliding_moves(r, c, QUEEN_RAYS[r][c], moves)
+
     def get_king_moves(self, r, c, moves):
         """
         Get all possible moves for the king located at (r, w) and add them the list of all
         possible moves
         """
-        i = 1
-        if r - i >= 0:      # There were no obstacles top or end of the board
-            if self.board[r-i][c][0] != self.board[r][c][0]:      # If it's an enemy piece pr empty
-                # Capture it and don't look for movre moves
-                moves.append(Move((r,c), (r-i,c), self.board))
-        if c + i <= 7:
-            if self.board[r][c+i][0] != self.board[r][c][0]:      # If it's an enemy piece pr empty
-                moves.append(Move((r,c), (r,c+i), self.board))
-        if r + i <= 7:
-            if self.board[r+i][c][0] != self.board[r][c][0]:      # If it's an enemy piece pr empty
-                # Capture it and don't look for movre moves
-                moves.append(Move((r,c), (r+i,c), self.board)) 
-        if  c - i >= 0:
-            if self.board[r][c-i][0] != self.board[r][c][0]:      # If it's an enemy piece pr empty
-                moves.append(Move((r,c), (r,c-i), self.board))
-        if r - i >= 0 and c + i <= 7:      # There were no obstacles top or end of the board
-            if self.board[r-i][c+i][0] != self.board[r][c][0]:      # If it's an enemy piece
-                # Capture it and don't look for movre moves
-                moves.append(Move((r,c), (r-i,c+i), self.board))
-        if c + i <= 7 and r + i <= 7:
-            if self.board[r+i][c+i][0] != self.board[r][c][0]:      # If it's an enemy piece
-                moves.append(Move((r,c), (r+i,c+i), self.board))
-        if r + i <= 7 and c - i >= 0:
-            if self.board[r+i][c-i][0] != self.board[r][c][0]:      # If it's an enemy piece
-                # Capture it and don't look for movre moves
-                moves.append(Move((r,c), (r+i,c-i), self.board)) 
-        if c - i >= 0 and r - i >= 0:
-            if self.board[r-i][c-i][0] != self.board[r][c][0]:      # If it's an enemy piece
-                moves.append(Move((r,c), (r-i,c-i), self.board))
+        ally = self.board[r][c][0]
+        for end_row, end_col in KING_TARGETS[r][c]:
+            if self.board[end_row][end_col][0] != ally:      # If it's an enemy piece or empty
+                moves.append(Move((r,c), (end_row,end_col), self.board))
+
+    def get_sliding_moves(self, r, c, rays, moves):
+        """
+        Get all possible moves along the given rays for the rook, bishop or queen located at (r, c)
+        """
+        ally = self.board[r][c][0]
+        for ray in rays:
+            for end_row, end_col in ray:
+                end_piece = self.board[end_row][end_col]
+                if end_piece == '--':
+                    moves.append(Move((r,c), (end_row,end_col), self.board))
+                else:
+                    if end_piece[0] != ally:      # If it's an enemy piece
+                        # Capture it and don't look for more moves
+                        moves.append(Move((r,c), (end_row,end_col), self.board))
+                    break
 
     def get_castle_moves(self, r, c, moves):
         """
@@ -469,6 +625,22 @@ class GameState():
                 moves.append(Move((r,c), (r,c-2), self.board, is_castle_move = True))
 
 
+def zobrist_enpassant_key(enpassant_possible):
+    """
+    Hash of the enpassant square, an empty tuple means no enpassant is possible
+    """
+    return ZOBRIST_ENPASSANT[enpassant_possible[1]] if enpassant_possible else 0
+
+def zobrist_castling_key(castle_rights):
+    """
+    Hash of the castling rights
+    """
+    key = 0
+    for i, right in enumerate((castle_rights.wks, castle_rights.bks, castle_rights.wqs, castle_rights.bqs)):
+        if right:
+            key ^= ZOBRIST_CASTLING[i]
+    return key
+
 class CastleRights():
     """
     Keeps track of whether a player can castle, and which side
@@ -490,7 +662,7 @@ class Move():
     files_to_cols = {"a": 0, "b": 1, "c": 2, "d": 3,
                      "e": 4, "f": 5, "g": 6, "h": 7}
     cols_to_files = {v: k for k, v in files_to_cols.items()}
-    def __init__(self, start_sq, end_sq, board, is_enpassant_move = False, is_castle_move = False):
+    def __init__(self, start_sq, end_sq, board, is_enpassant_move = False, is_castle_move = False, promotion_choice = 'Q'):
         self.start_row = start_sq[0]
         self.start_col = start_sq[1]
         self.end_row = end_sq[0]
@@ -499,6 +671,7 @@ class Move():
         self.piece_captured = board[self.end_row][self.end_col]  
         # Pawn promotion
         self.is_pawn_promotion = (self.piece_moved == 'wP' and self.end_row == 0) or (self.piece_moved == 'bP' and self.end_row == 7)
+        self.promotion_choice = promotion_choice    # Piece type the pawn becomes, the AI always picks a queen
         # Enpassant
         self.is_enpassant_move = is_enpassant_move
         if self.is_enpassant_move:
@@ -1,10 +1,14 @@
 '''
 This is our main driver file. It ill be responsible for handling user input and displaying the current Game State object.
 '''
-import pygame as p
+import os
+import time
 import chess_engine
 import chess_ai_agent as ai
-from multiprocessing import Queue
+from multiprocessing import Process, Queue, Value
+# Search processes started with the spawn method import this file again as __mp_main__, they don't need pygame
+if __name__ != "__mp_main__":
+    import pygame as p
 
 BOARD_WIDTH = BOARD_HEIGHT = 512
 MOVE_LOG_PANEL_WIDTH = 320
@@ -13,19 +17,55 @@ DIMENSION = 8 # A chess board is 8x8
 SQ_SIZE = BOARD_HEIGHT // DIMENSION
 MAX_FPS = 15 # For animations
 IMAGES = {}
+PONDERING = True    # Search the predicted reply on the human's time
+MULTI_PV_SHOWN_PLIES = 5    # How much of each multi-PV line the move log panel shows
+ANALYSIS_CACHE_FILE = "analysis_cache.bin"     # The AI's analyses are kept here between games, None to turn off
+# Search in this process, a slice of time every frame, instead of in a search process (for machines with little
+# memory). Only algorithms 5 and 6 can be time-sliced, the others block until they are done. No pondering
+SINGLE_PROCESS_SEARCH = False
+SEARCH_SLICE = 0.03     # Seconds of search per frame
+SPRITE_CACHE_DIR = os.path.join("images", "cache")     # Piece images already scaled, one sprite atlas per SQ_SIZE
+PIECES = ["wP", "wR", "wN", "wB", "wQ", "wK", "bP", "bR", "bN", "bB", "bQ", "bK"]
 
 '''
-Initialize the global dictionary of IMAGES only once to save on computation
+Initialize the global dictionary of IMAGES only once to save on computation.
+The scaled images are kept side by side in a sprite atlas, so once it's saved a launch loads one image instead of
+loading and scaling twelve. It's made again when SQ_SIZE changes or an image in images/ is newer
 '''
 def load_images():
-    pieces = ["wP", "wR", "wN", "wB", "wQ", "wK", "bP", "bR", "bN", "bB", "bQ", "bK"]
-    for piece in pieces:
-        IMAGES[piece] = p.transform.scale(p.image.load(f"images/{piece}.png"), (SQ_SIZE, SQ_SIZE))
+    atlas_path = get_sprite_atlas_path(SQ_SIZE)
+    image_paths = [f"images/{piece}.png" for piece in PIECES]
+    try:
+        atlas_is_fresh = os.path.getmtime(atlas_path) >= max(os.path.getmtime(path) for path in image_paths)
+    except OSError:
+        atlas_is_fresh = False
+    if atlas_is_fresh:
+        atlas = p.image.load(atlas_path)
+    else:
+        atlas = p.Surface((SQ_SIZE * len(PIECES), SQ_SIZE), p.SRCALPHA)
+        for i, path in enumerate(image_paths):
+            # A straight copy of the pixels, alpha included, whatever blending rules this pygame version has
+            atlas.blit(p.transform.scale(p.image.load(path), (SQ_SIZE, SQ_SIZE)), (i * SQ_SIZE, 0), \
+                special_flags=p.BLEND_RGBA_MAX)
+        try:
+            os.makedirs(SPRITE_CACHE_DIR, exist_ok=True)
+            # Saved under another name first, so another launch never loads a half written atlas
+            temporary_path = atlas_path[:-len(".png")] + ".saving.png"
+            p.image.save(atlas, temporary_path)
+            os.replace(temporary_path, atlas_path)
+        except (OSError, p.error):
+            pass    # Can't write the cache, every launch scales the images
+    for i, piece in enumerate(PIECES):
+        IMAGES[piece] = atlas.subsurface((i * SQ_SIZE, 0, SQ_SIZE, SQ_SIZE))
     #NOTE: we can access each image  by 'Images['wP]' for example    
+
+def get_sprite_atlas_path(sq_size):
+    return os.path.join(SPRITE_CACHE_DIR, f"pieces_{sq_size}.png")
 '''
 The main driver, handling user input, and updating graphics
 '''
 def main():
+    ai.ANALYSIS_CACHE_FILE = ANALYSIS_CACHE_FILE     # For the searches run in this process, the others are given it
     p.init()
     p.display.set_caption('Chess')
     screen = p.display.set_mode((BOARD_WIDTH + MOVE_LOG_PANEL_WIDTH, BOARD_HEIGHT))
@@ -43,12 +83,22 @@ def main():
     game_over = False
     player_one = False # If a human is playing white, then this will be true.
     player_two = False # If a human is playing black , then this will be true.
-    # 0: random, 1: greedy, 2: minimax iterative, 3: minimax recursive, 4: negamax, 5: negamax alphabeta
+    # 0: random, 1: greedy, 2: minimax iterative, 3: minimax recursive, 4: negamax, 5: negamax alphabeta,
+    # 6: iterative deepening negamax alphabeta with null move pruning and late move reductions,
+    # 7: multi-PV negamax alphabeta, its best moves are shown under the move log
     player_one_alg = 1
     player_two_alg = 4
     ai_thinking = False # AI is currently trying to come up with a move
     move_finder_process = None 
+    sliced_search = None    # The AI's search when it is time-sliced
     move_undone = True
+    # Pondering: while the human thinks, the AI searches the position after the reply it predicts
+    ponder_process = None
+    ponder_move = None
+    ponder_searches = ponder_hits = 0
+    reply_times = []    # Seconds the human waited for each AI reply
+    multi_pv_lines = []     # Best moves of the AI's last multi-PV search
+    ai_turn_start_time = time.time()
     while running:
         human_turn = (gs.white_to_move and player_one) or (not gs.white_to_move and player_two)
         for e in p.event.get():
@@ -74,6 +124,19 @@ def main():
                                 animate = True
                                 sqSelected = ()
                                 playerClicks = []
+                                if ponder_process is not None:
+                                    ponder_hit = valid_moves[i] == ponder_move
+                                    if ponder_hit:
+                                        # The search goes on, and the time it already spent counts
+                                        ponder_hits += 1
+                                        ponder_stop_time.value = ponder_start_time + ai.TIME_LIMIT
+                                        move_finder_process, return_queue = ponder_process, ponder_queue
+                                        ai_thinking = True
+                                    else:
+                                        stop_process(ponder_process)
+                                    ponder_process = None
+                                    print(f"Ponder {'hit' if ponder_hit else 'miss'}, hits: {ponder_hits}/{ponder_searches}")
+                                ai_turn_start_time = time.time()
                         if not move_made:
                             playerClicks = [sqSelected] # Enables resetting a click when a user clicks on two same-color pieces
             elif e.type == p.KEYDOWN:
@@ -82,44 +145,107 @@ def main():
                     move_made = True
                     animate = False
                     game_over = False
-                    if ai_thinking:
-                        move_finder_process.terminate()
-                        ai_thinking = False
+                    multi_pv_lines = []
+                    if sliced_search is not None:
+                        sliced_search.cancel()
+                        sliced_search = None
+                    elif ai_thinking:
+                        stop_process(move_finder_process)
+                    ai_thinking = False
+                    if ponder_process is not None:
+                        stop_process(ponder_process)
+                        ponder_process = None
                     move_undone = True
+                    ai_turn_start_time = time.time()
                 elif e.key == p.K_r:        # Reset the board
                     gs = chess_engine.GameState()
                     valid_moves = gs.get_valid_moves()
+                    multi_pv_lines = []
                     sqSelected = ()
                     playerClicks = []
                     move_made = False
                     animate = False
                     game_over = False
-                    if ai_thinking:
-                        move_finder_process.terminate()
-                        ai_thinking = False
+                    if sliced_search is not None:
+                        sliced_search.cancel()
+                        sliced_search = None
+                    elif ai_thinking:
+                        stop_process(move_finder_process)
+                    ai_thinking = False
+                    if ponder_process is not None:
+                        stop_process(ponder_process)
+                        ponder_process = None
                     move_undone = True
+                    ai_turn_start_time = time.time()
         # AI agent
         if not game_over and not human_turn and move_undone: # If it's the AI turn
+            ai_algo = player_one_alg if gs.white_to_move else player_two_alg
+            search_result = None
             if not ai_thinking:
                 ai_thinking = True
-                return_queue = Queue() # Used to pass data between threads                
-                ai.find_best_move(gs, valid_moves, (player_one_alg if gs.white_to_move else player_two_alg), return_queue)
-                ai_move = return_queue.get()
+                if SINGLE_PROCESS_SEARCH and ai_algo == 5:
+                    sliced_search = ai.TimeSlicedSearch(gs, ai.DEPTH, float("inf"), ai.DEPTH)
+                elif SINGLE_PROCESS_SEARCH and ai_algo == 6:
+                    sliced_search = ai.TimeSlicedSearch(gs)
+                elif SINGLE_PROCESS_SEARCH:
+                    ai_move = ai.find_best_move(gs, list(valid_moves), ai_algo)
+                    search_result = ai_move, ai.principal_variation, ai.multi_pv_lines
+                else:
+                    return_queue = Queue() # Used to pass data between processes
+                    move_finder_process = Process(target=ai.search_position, args=(gs.get_snapshot(), ai_algo, return_queue, \
+                        None, ANALYSIS_CACHE_FILE))
+                    move_finder_process.start()
+            if sliced_search is not None:
+                # The frame is drawn and the input handled between the slices, so the board stays responsive
+                if sliced_search.step(SEARCH_SLICE):
+                    print(f"Depth: {sliced_search.depth}, search time: {sliced_search.search_time:.2f}s")
+                    search_result = sliced_search.get_best_move(), [], []
+                    sliced_search = None
+            elif not SINGLE_PROCESS_SEARCH and not return_queue.empty():      # The search is done
+                search_result = return_queue.get()
+                move_finder_process.join()
+            elif not SINGLE_PROCESS_SEARCH and move_finder_process.exitcode is not None and return_queue.empty():
+                # The search process died without a move (its traceback is printed by multiprocessing). Checking the
+                # queue again after the exit code catches a move put just before the process exited
+                print(f"The search process failed with exit code {move_finder_process.exitcode}, playing a random move")
+                move_finder_process.join()
+                search_result = None, [], []
+            if search_result is not None:
+                ai_move, principal_variation, multi_pv_lines = search_result
+                # The move was rebuilt from another game state, use the matching valid move
+                ai_move = next((move for move in valid_moves if move == ai_move), None)
                 if ai_move is None:
-                    ai_move = ai.find_random_move(valid_moves) # Should never need to call this
+                    ai_move = ai.find_random_move(valid_moves) # When the search failed or found no move
                 gs.make_move(ai_move)
                 move_made = True
                 animate = True
                 sqSelected = () # Deselect
                 playerClicks = []
                 ai_thinking = False
+                if player_one or player_two:
+                    reply_times.append(time.time() - ai_turn_start_time)
+                human_next = (gs.white_to_move and player_one) or (not gs.white_to_move and player_two)
+                # Predict the human's reply from the principal variation, and search the position after it
+                if PONDERING and not SINGLE_PROCESS_SEARCH and human_next and len(principal_variation) > 1 \
+                        and principal_variation[0] == ai_move and principal_variation[1] in gs.get_valid_moves():
+                    ponder_move = principal_variation[1]
+                    gs.make_move(ponder_move)
+                    ponder_snapshot = gs.get_snapshot()
+                    gs.undo_move()
+                    ponder_queue = Queue()
+                    ponder_stop_time = Value("d", 0.0)      # Set when the human plays, the search runs until then
+                    ponder_start_time = time.time()
+                    ponder_process = Process(target=ai.search_position, \
+                        args=(ponder_snapshot, ai_algo, ponder_queue, ponder_stop_time, ANALYSIS_CACHE_FILE))
+                    ponder_process.start()
+                    ponder_searches += 1
         if move_made:
             if animate:
                 animate_move(gs.move_log[-1], screen, gs.board, clock)
             valid_moves = gs.get_valid_moves()
             move_made = False
             animate = False
-        draw_game_state(screen, gs, valid_moves, sqSelected, movelog_font)
+        draw_game_state(screen, gs, valid_moves, sqSelected, movelog_font, multi_pv_lines)
         
         if gs.check_mate or gs.stale_mate:
             game_over = True 
@@ -133,6 +259,23 @@ def main():
         
         clock.tick(MAX_FPS)
         p.display.flip()
+    if sliced_search is not None:
+        sliced_search.cancel()
+    elif ai_thinking and not SINGLE_PROCESS_SEARCH:
+        stop_process(move_finder_process)
+    if ponder_process is not None:
+        stop_process(ponder_process)
+    if ponder_searches:
+        print(f"Ponder hits: {ponder_hits}/{ponder_searches} ({ponder_hits / ponder_searches:.0%})")
+    if reply_times:
+        print(f"Average AI reply time: {sum(reply_times) / len(reply_times):.2f}s over {len(reply_times)} replies")
+
+def stop_process(process):
+    """
+    Cancel a search process. Its queue may be left broken, so it shouldn't be used again
+    """
+    process.terminate()
+    process.join()
     
 def highlight_squares(screen, gs, valid_moves, sq_selected):
     """
@@ -158,11 +301,12 @@ def highlight_squares(screen, gs, valid_moves, sq_selected):
 '''
 Responsible for all the graphics withing our current game state
 '''
-def draw_game_state(screen, gs, valid_moves, sq_selected, movelog_font):
+def draw_game_state(screen, gs, valid_moves, sq_selected, movelog_font, multi_pv_lines=()):
     draw_board(screen) # Draw squares on the board
     highlight_squares(screen, gs,  valid_moves, sq_selected)
     draw_pieces(screen, gs.board) # Draw pieces on top of the board
     draw_move_log(screen, gs, movelog_font)
+    draw_multi_pv(screen, multi_pv_lines, movelog_font)
     
 ''' Draw the squares on the board. The top left square is always light '''
 def draw_board(screen):
@@ -241,6 +385,25 @@ def draw_move_log(screen, gs, font):
         text_y += textObject.get_height() + line_spacing
     
     
+
+def draw_multi_pv(screen, multi_pv_lines, font):
+    """
+    Draws the AI's best moves from its last multi-PV search at the bottom of the move log panel, best first,
+    with their scores for the AI and the start of their lines
+    """
+    if not multi_pv_lines:
+        return
+    padding = 5
+    line_spacing = 2
+    texts = ["AI's best moves:"]
+    for rank, (move, score, line) in enumerate(multi_pv_lines, 1):
+        texts.append(f"{rank}. {move} {score:+.2f}  " + " ".join(str(line_move) for line_move in line[:MULTI_PV_SHOWN_PLIES]))
+    text_y = MOVE_LOG_PANEL_HEIGHT - padding
+    for text in reversed(texts):
+        textObject = font.render(text, True, p.Color('Yellow'))
+        text_y -= textObject.get_height()
+        screen.blit(textObject, (BOARD_WIDTH + padding, text_y))
+        text_y -= line_spacing
       
 def draw_endgame_text(screen, text):
     font = p.font.SysFont("Helvetica", 32, True, False)
@@ -0,0 +1,236 @@
+'''
+Reading and writing games in PGN (Portable Game Notation) with moves in SAN (Standard Algebraic Notation, e.g. "Nxe5+").
+The reader streams a file one line at a time and yields the games one by one, so even huge game databases are read
+in constant memory. Games set up from another position, like puzzles, start from the position of their FEN tag.
+Usage: python chess_pgn.py games.pgn     (replays every game and reports the ones that can't be replayed)
+'''
+import re
+import sys
+import chess_engine
+
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+SEVEN_TAG_ROSTER = ("Event", "Site", "Date", "Round", "White", "Black", "Result")
+TAG_REGEX = re.compile(r'^\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+SAN_REGEX = re.compile(r"^([NBRQK])?([a-h])?([1-8])?(x)?([a-h][1-8])(?:=?([NBRQ]))?$")
+# Movetext tokens: comments, variations, NAGs, move numbers, results and moves
+TOKEN_REGEX = re.compile(r"\{|\}|\(|\)|;|\$\d+|\d+\.+|1-0|0-1|1/2-1/2|\*|[^\s{}();]+")
+MAX_LINE_LENGTH = 80
+
+class PGNGame():
+    """
+    A game read from a PGN file: its tags, its moves in SAN and its result
+    """
+    def __init__(self, headers=None, moves=None, result="*"):
+        self.headers = headers if headers is not None else {}
+        self.moves = moves if moves is not None else []
+        self.result = result
+
+    def get_start_position(self):
+        """
+        Returns a GameState at the position the game starts from: the FEN tag of a game set up from another
+        position (a puzzle), or the standard starting position. Raises ValueError if the FEN can't be read
+        """
+        if "FEN" in self.headers:
+            return chess_engine.GameState.from_fen(self.headers["FEN"])
+        if self.headers.get("SetUp") == "1":
+            raise ValueError("the game is set up from another position, but has no FEN tag")
+        return chess_engine.GameState()
+
+    def replay(self):
+        """
+        Play the moves from the starting position, yielding the game state after each move together with the move.
+        The same GameState object is yielded every time. Raises ValueError on a move that isn't valid, or if the
+        starting position can't be set up
+        """
+        gs = self.get_start_position()
+        for san in self.moves:
+            move = san_to_move(gs, san)
+            gs.make_move(move)
+            yield gs, move
+
+    def to_game_state(self):
+        """
+        Returns the GameState at the end of the game
+        """
+        gs = self.get_start_position()
+        for san in self.moves:
+            gs.make_move(san_to_move(gs, san))
+        return gs
+
+def read_games(pgn_file):
+    """
+    Yield the games of an open PGN file one at a time, reading it line by line
+    """
+    game = PGNGame()
+    comment = False     # Inside a {comment}, which can span lines
+    variation_depth = 0     # Inside (variations), which are skipped
+    for line in pgn_file:
+        line = line.lstrip("\ufeff").rstrip("\r\n")
+        if not comment and variation_depth == 0:
+            if line.startswith("%"):        # Escaped line
+                continue
+            tag = TAG_REGEX.match(line)
+            if tag:
+                if game.moves:      # A game without a result
+                    yield game
+                    game = PGNGame()
+                game.headers[tag.group(1)] = tag.group(2).replace('\\"', '"').replace("\\\\", "\\")
+                continue
+        for token in TOKEN_REGEX.findall(line):
+            if comment:
+                comment = token != "}"
+            elif token == "{":
+                comment = True
+            elif token == ";":      # Comment until the end of the line
+                break
+            elif token == "(":
+                variation_depth += 1
+            elif token == ")":
+                variation_depth = max(variation_depth - 1, 0)
+            elif variation_depth or token[0] == "$" or token[0].isdigit() and token.endswith("."):
+                continue
+            elif token in RESULTS:
+                game.result = token
+                yield game
+                game = PGNGame()
+            else:
+                game.moves.append(token)
+    if game.moves or game.headers:
+        yield game
+
+def read_games_from_path(path):
+    """
+    Yield the games of the PGN file at path one at a time
+    """
+    with open(path, encoding="utf-8", errors="replace") as pgn_file:
+        yield from read_games(pgn_file)
+
+def san_to_move(gs, san, valid_moves=None):
+    """
+    Find the valid move of the current position that san describes. Raises ValueError if there isn't exactly one
+    """
+    if valid_moves is None:
+        valid_moves = gs.get_valid_moves()
+    text = san.rstrip("+#!?")
+    if text in ("O-O", "0-0", "O-O-O", "0-0-0"):
+        end_col = 6 if len(text) == 3 else 2
+        candidates = [move for move in valid_moves if move.is_castle_move and move.end_col == end_col]
+        promotion = None
+    else:
+        match = SAN_REGEX.match(text)
+        if not match:
+            raise ValueError(f"Can't read the move {san}")
+        piece_type, from_file, from_rank, _, end_square, promotion = match.groups()
+        piece_type = piece_type or "P"
+        end_row = chess_engine.Move.ranks_to_rows[end_square[1]]
+        end_col = chess_engine.Move.files_to_cols[end_square[0]]
+        candidates = [move for move in valid_moves if move.piece_moved[1] == piece_type \
+            and move.end_row == end_row and move.end_col == end_col \
+            and (from_file is None or move.start_col == chess_engine.Move.files_to_cols[from_file]) \
+            and (from_rank is None or move.start_row == chess_engine.Move.ranks_to_rows[from_rank])]
+    if len(candidates) != 1:
+        raise ValueError(f"{san} {'is ambiguous' if candidates else 'is not a valid move'} after " \
+            f"{' '.join(str(move) for move in gs.move_log) or 'the start'}")
+    move = candidates[0]
+    if promotion and promotion != move.promotion_choice:
+        move = chess_engine.Move((move.start_row, move.start_col), (move.end_row, move.end_col), gs.board, \
+            promotion_choice=promotion)
+    return move
+
+def move_to_san(gs, move, valid_moves=None):
+    """
+    Write a move of the current position in SAN, including the check or checkmate sign
+    """
+    if valid_moves is None:
+        valid_moves = gs.get_valid_moves()
+    if move.is_castle_move:
+        san = "O-O" if move.end_col > move.start_col else "O-O-O"
+    else:
+        piece_type = move.piece_moved[1]
+        end_square = move.get_rank_file(move.end_row, move.end_col)
+        if piece_type == "P":
+            san = (move.cols_to_files[move.start_col] + "x" if move.is_capture_move else "") + end_square
+            if move.is_pawn_promotion:
+                san += "=" + move.promotion_choice
+        else:
+            # Disambiguate from other pieces of the same type that can move to the same square
+            others = [other for other in valid_moves if other.piece_moved == move.piece_moved \
+                and other.end_row == move.end_row and other.end_col == move.end_col and other != move]
+            disambiguation = ""
+            if others:
+                if all(other.start_col != move.start_col for other in others):
+                    disambiguation = move.cols_to_files[move.start_col]
+                elif all(other.start_row != move.start_row for other in others):
+                    disambiguation = move.rows_to_ranks[move.start_row]
+                else:
+                    disambiguation = move.get_rank_file(move.start_row, move.start_col)
+            san = piece_type + disambiguation + ("x" if move.is_capture_move else "") + end_square
+    gs.make_move(move)
+    if gs.in_check():
+        gs.get_valid_moves()
+        san += "#" if gs.check_mate else "+"
+    gs.undo_move()
+    return san
+
+def format_game(move_log, headers=None, result="*"):
+    """
+    Write the moves of move_log, played from the starting position, as a PGN game with the given tags
+    """
+    headers = dict(headers or {})
+    headers["Result"] = result
+    tags = list(SEVEN_TAG_ROSTER) + [tag for tag in headers if tag not in SEVEN_TAG_ROSTER]
+    lines = []
+    for tag in tags:
+        value = str(headers.get(tag, "????.??.??" if tag == "Date" else "?")).replace("\\", "\\\\").replace('"', '\\"')
+        lines.append(f'[{tag} "{value}"]')
+    lines.append("")
+
+    gs = chess_engine.GameState()
+    tokens = []
+    for i, move in enumerate(move_log):
+        if i % 2 == 0:
+            tokens.append(f"{i//2 + 1}.")
+        tokens.append(move_to_san(gs, move))
+        gs.make_move(move)
+    tokens.append(result)
+    line = ""
+    for token in tokens:        # Wrap the movetext
+        if line and len(line) + 1 + len(token) > MAX_LINE_LENGTH:
+            lines.append(line)
+            line = token
+        else:
+            line = f"{line} {token}" if line else token
+    lines.append(line)
+    return "\n".join(lines) + "\n\n"
+
+def write_game(pgn_file, gs, headers=None, result=None):
+    """
+    Append the game played in gs to an open PGN file. The result is taken from gs if it isn't given
+    """
+    if result is None:
+        if gs.check_mate:
+            result = "0-1" if gs.white_to_move else "1-0"
+        elif gs.stale_mate:
+            result = "1/2-1/2"
+        else:
+            result = "*"
+    pgn_file.write(format_game(gs.move_log, headers, result))
+
+def main():
+    if len(sys.argv) != 2:
+        print("Usage: python chess_pgn.py games.pgn")
+        return 1
+    games = moves = errors = 0
+    for games, game in enumerate(read_games_from_path(sys.argv[1]), 1):
+        try:
+            for _ in game.replay():
+                moves += 1
+        except ValueError as error:
+            errors += 1
+            print(f"Game {games} ({game.headers.get('White', '?')} - {game.headers.get('Black', '?')}): {error}")
+    print(f"{games} games, {moves} moves replayed, {errors} games with errors")
+    return 1 if errors else 0
+
+# Best practice to ensure the function only runs when the file is run directly
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,267 @@
+'''
+Headless session manager for hosting many human vs AI games at once. Games are plain GameState objects that take
+moves through an asyncio API, while the AI searches run in a bounded process pool. The positions are sent to the
+workers as snapshots, so the cost doesn't grow with the length of the game.
+Searches are queued per game and dispatched round robin, so a game with many requests can't starve the others.
+'''
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import contextlib
+import io
+import itertools
+import os
+import random
+import time
+import chess_engine
+import chess_ai_agent as ai
+
+DEFAULT_ALGO_TYPE = 6       # Iterative deepening, the only algorithm that keeps to a time budget
+DEFAULT_TIME_LIMIT = 2      # Seconds per AI move
+LATENCY_SAMPLES = 1000      # How many recent queueing latencies the metrics are computed from
+
+def search_snapshot(snapshot, algo_type, time_limit):
+    """
+    Runs in a worker process: rebuild the position from its snapshot and search it.
+    Returns the id of the best move, the number of nodes searched and the time it took
+    """
+    gs = chess_engine.GameState.from_snapshot(snapshot)
+    valid_moves = gs.get_valid_moves()
+    ai.TIME_LIMIT = time_limit
+    ai.reset_counters()
+    start_time = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):     # Hide the counters find_best_move prints
+        best_move = ai.find_best_move(gs, valid_moves, algo_type)
+    if best_move is None:
+        best_move = ai.find_random_move(valid_moves)   # Should never need to call this
+    return best_move.move_id, ai.count_nodes(), time.perf_counter() - start_time
+
+class GameSession():
+    """
+    A single game between a human and the AI
+    """
+    def __init__(self, game_id, algo_type, time_limit, ai_plays_white):
+        self.game_id = game_id
+        self.gs = chess_engine.GameState()
+        self.valid_moves = self.gs.get_valid_moves()
+        self.algo_type = algo_type
+        self.time_limit = time_limit
+        self.ai_plays_white = ai_plays_white
+        self.ai_thinking = False
+
+    def is_over(self):
+        return self.gs.check_mate or self.gs.stale_mate
+
+    def is_ai_turn(self):
+        return not self.is_over() and self.gs.white_to_move == self.ai_plays_white
+
+    def play(self, move):
+        self.gs.make_move(move)
+        self.valid_moves = self.gs.get_valid_moves()
+
+class SessionManager():
+    """
+    Holds many games and serves the AI's replies from a pool of worker processes
+    """
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.pool = concurrent.futures.ProcessPoolExecutor(self.max_workers)
+        self.games = {}
+        self.game_ids = itertools.count(1)
+        # Fair queuing: every game has its own queue of searches, and the games take turns
+        self.search_queues = collections.OrderedDict()
+        self.search_available = asyncio.Semaphore(0)      # Released once for every queued search
+        self.dispatchers = []
+        # Metrics
+        self.start_time = time.perf_counter()
+        self.searches_completed = 0
+        self.nodes_searched = 0
+        self.search_time = 0
+        self.games_completed = 0
+        self.queue_latencies = collections.deque(maxlen=LATENCY_SAMPLES)
+
+    def start(self):
+        """
+        Start one dispatcher for every worker process, must be called from the running event loop
+        """
+        if not self.dispatchers:
+            self.dispatchers = [asyncio.create_task(self.dispatch()) for _ in range(self.max_workers)]
+
+    async def close(self):
+        """
+        Stop the dispatchers and the worker processes
+        """
+        for dispatcher in self.dispatchers:
+            dispatcher.cancel()
+        await asyncio.gather(*self.dispatchers, return_exceptions=True)
+        self.dispatchers = []
+        self.pool.shutdown(cancel_futures=True)
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def create_game(self, algo_type=DEFAULT_ALGO_TYPE, time_limit=DEFAULT_TIME_LIMIT, ai_plays_white=False):
+        """
+        Start a new game and return its id. If the AI plays white, call ai_move() for its first move
+        """
+        game_id = next(self.game_ids)
+        self.games[game_id] = GameSession(game_id, algo_type, time_limit, ai_plays_white)
+        return game_id
+
+    def close_game(self, game_id):
+        """
+        Forget a game and return its session, a search that is still queued for it is cancelled
+        """
+        game = self.games.pop(game_id)
+        for _, _, future in self.search_queues.pop(game_id, ()):
+            future.cancel()
+        return game
+
+    def get_game(self, game_id):
+        """
+        Returns the GameState of a game
+        """
+        return self.games[game_id].gs
+
+    async def play_move(self, game_id, move_text):
+        """
+        Play the human's move (in the "e2e4" notation of Move.__str__) and return the AI's reply the same way,
+        or None if the game is over. Raises ValueError if the move isn't valid or it isn't the human's turn
+        """
+        game = self.games[game_id]
+        if game.is_over() or game.is_ai_turn() or game.ai_thinking:
+            raise ValueError(f"It isn't the human's turn in game {game_id}")
+        for move in game.valid_moves:
+            if str(move) == move_text:
+                game.play(move)
+                break
+        else:
+            raise ValueError(f"{move_text} isn't a valid move in game {game_id}")
+        if game.is_over():
+            self.games_completed += 1
+            return None
+        return await self.ai_move(game_id)
+
+    async def ai_move(self, game_id):
+        """
+        Search for the AI's move in the worker pool, play it and return it in the "e2e4" notation
+        """
+        game = self.games[game_id]
+        if not game.is_ai_turn() or game.ai_thinking:
+            raise ValueError(f"It isn't the AI's turn in game {game_id}")
+        game.ai_thinking = True
+        try:
+            move_id = await self.submit_search(game_id, game.gs.get_snapshot(), game.algo_type, game.time_limit)
+        finally:
+            game.ai_thinking = False
+        move = next(move for move in game.valid_moves if move.move_id == move_id)
+        game.play(move)
+        if game.is_over():
+            self.games_completed += 1
+        return str(move)
+
+    def submit_search(self, game_id, snapshot, algo_type, time_limit):
+        """
+        Queue a search of the snapshot for the game and return a future for the id of the best move
+        """
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        self.search_queues.setdefault(game_id, collections.deque()).append( \
+            (snapshot, (algo_type, time_limit, time.perf_counter()), future))
+        self.search_available.release()
+        return future
+
+    async def next_search(self):
+        """
+        Wait for a queued search and take it from the game whose turn it is
+        """
+        while True:
+            await self.search_available.acquire()
+            if not self.search_queues:      # The search was cancelled by close_game()
+                continue
+            game_id, searches = self.search_queues.popitem(last=False)
+            search = searches.popleft()
+            if searches:        # The game goes to the back of the line
+                self.search_queues[game_id] = searches
+            return search
+
+    async def dispatch(self):
+        """
+        Keep one worker process busy with the queued searches
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            snapshot, (algo_type, time_limit, queued_time), future = await self.next_search()
+            if future.cancelled():
+                continue
+            self.queue_latencies.append(time.perf_counter() - queued_time)
+            try:
+                move_id, nodes, search_time = await loop.run_in_executor(self.pool, search_snapshot, snapshot, \
+                    algo_type, time_limit)
+            except Exception as error:      # pylint: disable=broad-except
+                if not future.cancelled():
+                    future.set_exception(error)
+                continue
+            self.searches_completed += 1
+            self.nodes_searched += nodes
+            self.search_time += search_time
+            if not future.cancelled():
+                future.set_result(move_id)
+
+    def get_metrics(self):
+        """
+        Throughput and queueing latency of the AI searches since the manager was created
+        """
+        uptime = time.perf_counter() - self.start_time
+        latencies = sorted(self.queue_latencies)
+        return {
+            "active_games": len(self.games),
+            "queued_searches": sum(len(searches) for searches in self.search_queues.values()),
+            "workers": self.max_workers,
+            "searches_completed": self.searches_completed,
+            "games_completed": self.games_completed,
+            "games_per_core_per_hour": self.games_completed / self.max_workers / uptime * 3600 if uptime else 0.0,
+            "searches_per_core_per_second": self.searches_completed / self.max_workers / uptime if uptime else 0.0,
+            "nodes_per_second": self.nodes_searched / self.search_time if self.search_time else 0.0,
+            "average_queue_latency": sum(latencies) / len(latencies) if latencies else 0.0,
+            "p95_queue_latency": latencies[int(len(latencies) * 0.95)] if latencies else 0.0,
+            "max_queue_latency": latencies[-1] if latencies else 0.0,
+        }
+
+async def play_random_game(manager, max_moves, algo_type, time_limit):
+    """
+    A stand-in human who plays random moves against the AI, for load testing
+    """
+    game_id = manager.create_game(algo_type, time_limit)
+    gs = manager.get_game(game_id)
+    for _ in range(max_moves):
+        valid_moves = gs.get_valid_moves()
+        if not valid_moves or await manager.play_move(game_id, str(random.choice(valid_moves))) is None:
+            break
+    manager.close_game(game_id)
+
+async def run_load_test(games, workers, max_moves, algo_type, time_limit):
+    async with SessionManager(workers) as manager:
+        await asyncio.gather(*(play_random_game(manager, max_moves, algo_type, time_limit) for _ in range(games)))
+        return manager.get_metrics()
+
+def main():
+    parser = argparse.ArgumentParser(description="Play many random games against the AI at once and report metrics")
+    parser.add_argument("--games", type=int, default=8, help="number of simultaneous games")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("--moves", type=int, default=10, help="human moves per game")
+    parser.add_argument("--algo", type=int, default=DEFAULT_ALGO_TYPE, help="algo_type of the AI")
+    parser.add_argument("--time-limit", type=float, default=DEFAULT_TIME_LIMIT, help="seconds per AI move")
+    args = parser.parse_args()
+    metrics = asyncio.run(run_load_test(args.games, args.workers, args.moves, args.algo, args.time_limit))
+    for name, value in metrics.items():
+        print(f"{name}: {value:.3f}" if isinstance(value, float) else f"{name}: {value}")
+
+# Best practice to ensure the function only runs when the file is run directly
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+'''
+Lazy SMP: several processes search the same position at once and share one transposition table in shared memory.
+The processes don't divide the work between them, they just search the same tree, each starting at a different
+depth and in a different move order, and every position one of them finishes is a transposition table hit for the
+others. The main process's search gives the move, the helpers only fill the table.
+The table is lockless: an entry is two 64 bit words, the position's key XORed with the data and the data itself.
+A write torn by another process leaves words that don't XOR back to the key, so the entry is ignored when probed.
+Usage: python chess_smp.py [--processes 1 2 4] [--depth 4]      (measures how the search scales with processes)
+'''
+import argparse
+import contextlib
+import io
+import multiprocessing
+import random
+import threading
+import time
+from multiprocessing import shared_memory
+import chess_engine
+import chess_ai_agent as ai
+import chess_benchmark
+
+ENTRY_WORDS = 2     # 64 bit words per entry: key ^ data, data
+SCORE_SCALE = 10000     # Scores are stored as integers, in 1/10000 of a pawn
+SCORE_OFFSET = 2 ** 31      # Makes the stored scores unsigned
+NO_MOVE = 0     # move_id 0 (a8 to a8) is never a real move
+DEPTH_STAGGER = 2       # Helper i starts its iterative deepening at depth 1 + i % DEPTH_STAGGER
+STOP_POLL_INTERVAL = 0.01       # Seconds between the stop signals a helper's watcher gives its search
+
+class SharedTranspositionTable():
+    """
+    A transposition table in shared memory, with the same probe(), store() and clear() as
+    chess_ai_agent.TranspositionTable. Create it in one process and attach to it by name in the others
+    """
+    def __init__(self, name=None, size=ai.TRANSPOSITION_TABLE_SIZE):
+        self.size = size
+        self.created = name is None
+        if self.created:
+            self.memory = shared_memory.SharedMemory(create=True, size=size * ENTRY_WORDS * 8)
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+        self.name = self.memory.name
+        self.words = self.memory.buf.cast("Q")
+        if self.created:
+            self.clear()
+
+    def probe(self, key):
+        """
+        Returns (depth, flag, score, move_id) for the position, or None if it isn't stored or the entry is torn
+        """
+        index = (key & (self.size - 1)) * ENTRY_WORDS
+        data = self.words[index + 1]
+        if not data or self.words[index] ^ data != key:
+            return None
+        move_id = data >> 42
+        return (data >> 32) & 0xFF, (data >> 40) & 0x3, ((data & 0xFFFFFFFF) - SCORE_OFFSET) / SCORE_SCALE, \
+            None if move_id == NO_MOVE else move_id
+
+    def store(self, key, depth, flag, score, move_id):
+        index = (key & (self.size - 1)) * ENTRY_WORDS
+        old_data = self.words[index + 1]
+        # Keep a deeper entry for the same position, like TranspositionTable does
+        if old_data and self.words[index] ^ old_data == key and (old_data >> 32) & 0xFF > depth:
+            return
+        data = (round(score * SCORE_SCALE) + SCORE_OFFSET) | depth << 32 | flag << 40 | \
+            (NO_MOVE if move_id is None else move_id) << 42
+        self.words[index] = key ^ data
+        self.words[index + 1] = data
+
+    def clear(self):
+        self.memory.buf[:] = bytes(len(self.memory.buf))
+
+    def close(self):
+        """
+        Detach from the shared memory, and free it if this is the process that created it
+        """
+        self.words.release()
+        self.memory.close()
+        if self.created:
+            self.memory.unlink()
+
+def search_helper(snapshot, table_name, table_size, helper_index, max_depth, time_limit, stop_event, node_counts):
+    """
+    Runs in a helper process: search the position into the shared table until the main search stops it.
+    Its node count is written to node_counts[helper_index]
+    """
+    gs = chess_engine.GameState.from_snapshot(snapshot)
+    valid_moves = gs.get_valid_moves()
+    table = SharedTranspositionTable(table_name, table_size)
+    ai.transposition_table = table
+    ai.reset_counters()
+    random.seed(helper_index)       # Different move orders for ties
+    searching = threading.Event()
+    searching.set()
+
+    def watch():
+        # Polled rather than waited on: a process that exits while waiting on a multiprocessing.Event makes set() hang
+        while searching.is_set():
+            if stop_event.is_set():     # The search clears search_aborted when it starts, so keep setting it
+                ai.search_aborted = True
+            time.sleep(STOP_POLL_INTERVAL)
+
+    watcher = threading.Thread(target=watch, daemon=True)
+    watcher.start()
+    with contextlib.redirect_stdout(io.StringIO()):
+        ai.find_iterative_deepening_move(gs, valid_moves, max_depth, time_limit, 1 + helper_index % DEPTH_STAGGER)
+    searching.clear()
+    node_counts[helper_index] = ai.count_nodes()
+    table.close()
+
+def find_lazy_smp_move(gs, valid_moves, processes, max_depth=None, time_limit=None, table=None):
+    """
+    Search the position with find_iterative_deepening_move() in this process and processes - 1 helpers sharing
+    a transposition table. A table can be given to keep it between moves, otherwise a new one is used.
+    Returns the best move and the number of nodes searched by all the processes together
+    """
+    max_depth = ai.MAX_DEPTH if max_depth is None else max_depth
+    time_limit = ai.TIME_LIMIT if time_limit is None else time_limit
+    own_table = table is None
+    if own_table:
+        table = SharedTranspositionTable()
+    local_table = ai.transposition_table
+    helpers = []        # The helpers started, stopped whatever goes wrong from here on
+    try:
+        stop_event = multiprocessing.Event()
+        node_counts = multiprocessing.Array("q", processes, lock=False)
+        snapshot = gs.get_snapshot()
+        for i in range(1, processes):
+            helper = multiprocessing.Process(target=search_helper, args=(snapshot, table.name, table.size, i, \
+                max_depth, time_limit, stop_event, node_counts), daemon=True)
+            helper.start()
+            helpers.append(helper)
+        ai.transposition_table = table
+        ai.reset_counters()
+        best_move = ai.find_iterative_deepening_move(gs, valid_moves, max_depth, time_limit)
+        node_counts[0] = ai.count_nodes()
+    finally:
+        ai.transposition_table = local_table
+        if helpers:
+            stop_event.set()
+        for helper in helpers:
+            helper.join(timeout=5)
+            if helper.is_alive():
+                helper.terminate()      # The table can't be corrupted by this, a torn entry is ignored
+        if own_table:
+            table.close()
+    return best_move, sum(node_counts)
+
+def measure_scaling(process_counts, depth):
+    """
+    Search every benchmark position to a fixed depth with each number of processes. Returns for each number
+    of processes the total time to reach the depth, the nodes searched by all the processes and the speedup
+    """
+    results = []
+    for processes in process_counts:
+        total_time = total_nodes = 0
+        for _, moves in chess_benchmark.BENCHMARK_POSITIONS:
+            gs = chess_benchmark.load_position(moves)
+            random.seed(chess_benchmark.BENCHMARK_SEED)
+            start_time = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                _, nodes = find_lazy_smp_move(gs, gs.get_valid_moves(), processes, depth, float("inf"))
+            total_time += time.perf_counter() - start_time
+            total_nodes += nodes
+        results.append({"processes": processes, "time": total_time, "nodes": total_nodes, \
+            "speedup": results[0]["time"] / total_time if results else 1.0})
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure how the Lazy SMP search scales with processes")
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4], help="process counts to compare")
+    parser.add_argument("--depth", type=int, default=4, help="depth every position is searched to")
+    args = parser.parse_args()
+    print(f"{multiprocessing.cpu_count()} cores")
+    print(f"{'processes':>10}{'time':>10}{'nodes':>12}{'nps':>10}{'speedup':>10}")
+    for run in measure_scaling(args.processes, args.depth):
+        print(f"{run['processes']:>10}{run['time']:>10.2f}{run['nodes']:>12}{run['nodes'] / run['time']:>10.0f}" \
+            f"{run['speedup']:>10.2f}")
+
+# Best practice to ensure the function only runs when the file is run directly
+if __name__ == "__main__":
+    main()
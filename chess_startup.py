@@ -0,0 +1,101 @@
+'''
+Startup time benchmark: how long a new process takes to be ready, for the GUI and for the processes that only
+search (the GUI's search processes, Lazy SMP helpers, tournament and distributed workers). Every run starts a
+fresh Python interpreter, since only a fresh one pays for the imports, and the median of the runs is shown.
+The GUI is measured without its sprite atlas (the first launch at a SQ_SIZE) and with it, which needs pygame
+Usage: python chess_startup.py [--repeats 5]
+'''
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Each process prints the seconds its startup phases took as JSON, and whether it imported pygame.
+# json is imported after the timing, so it is only counted where the engine imports it itself
+SEARCH_PROCESS_CODE = """
+import sys, time
+start_time = time.perf_counter()
+import chess_engine
+import chess_ai_agent
+imported_time = time.perf_counter()
+chess_engine.GameState().get_valid_moves()
+ready_time = time.perf_counter()
+import json
+print(json.dumps({"import": imported_time - start_time, "first moves": ready_time - imported_time, \
+    "pygame": "pygame" in sys.modules}))
+"""
+# A process started by the GUI with the spawn method runs chess_main.py again as __mp_main__ first
+SPAWNED_PROCESS_CODE = """
+import runpy, sys, time
+start_time = time.perf_counter()
+runpy.run_path("chess_main.py", run_name="__mp_main__")
+ready_time = time.perf_counter()
+import json
+print(json.dumps({"import": ready_time - start_time, "pygame": "pygame" in sys.modules}))
+"""
+# sys.argv[1] is "cold" to remove the sprite atlas first
+GUI_CODE = """
+import os, sys, time
+start_time = time.perf_counter()
+import chess_main
+imported_time = time.perf_counter()
+chess_main.p.init()
+chess_main.p.display.set_mode((chess_main.BOARD_WIDTH + chess_main.MOVE_LOG_PANEL_WIDTH, chess_main.BOARD_HEIGHT))
+initialized_time = time.perf_counter()
+atlas_path = chess_main.get_sprite_atlas_path(chess_main.SQ_SIZE)
+if sys.argv[1] == "cold" and os.path.exists(atlas_path):
+    os.remove(atlas_path)
+images_start_time = time.perf_counter()
+chess_main.load_images()
+ready_time = time.perf_counter()
+import json
+print(json.dumps({"import": imported_time - start_time, "display": initialized_time - imported_time, \
+    "images": ready_time - images_start_time, "pygame": True}))
+"""
+
+def measure_startup(code, repeats, arguments=()):
+    """
+    Run the code in repeats new interpreters. Returns the median seconds of each phase it reports, and of the
+    whole run ("total", interpreter startup included), or None if pygame isn't installed
+    """
+    environment = dict(os.environ, PYGAME_HIDE_SUPPORT_PROMPT="1")
+    environment.setdefault("SDL_VIDEODRIVER", "dummy")      # The GUI is measured without opening a window
+    runs = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        result = subprocess.run([sys.executable, "-c", code, *arguments], capture_output=True, text=True, \
+            env=environment, cwd=os.path.dirname(os.path.abspath(__file__)))
+        total = time.perf_counter() - start_time
+        if result.returncode != 0:
+            if "No module named 'pygame'" in result.stderr:
+                return None
+            raise RuntimeError(result.stderr.strip().splitlines()[-1])
+        run = json.loads(result.stdout.strip().splitlines()[-1])
+        run["total"] = total
+        runs.append(run)
+    timings = {name: statistics.median(run[name] for run in runs) for name in runs[0] if name != "pygame"}
+    timings["pygame"] = any(run["pygame"] for run in runs)
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure how long the GUI and search processes take to start")
+    parser.add_argument("--repeats", type=int, default=5, help="interpreters started per measurement")
+    args = parser.parse_args()
+    measurements = [("search process", SEARCH_PROCESS_CODE, ()), ("spawned GUI search process", SPAWNED_PROCESS_CODE, ()), \
+        ("GUI, no sprite atlas", GUI_CODE, ("cold",)), ("GUI, sprite atlas", GUI_CODE, ("warm",))]
+    print(f"{'process':<28}{'total':>10}  phases")
+    for name, code, arguments in measurements:
+        timings = measure_startup(code, args.repeats, arguments)
+        if timings is None:
+            print(f"{name:<28}{'skipped':>10}  pygame isn't installed")
+            continue
+        phases = ", ".join(f"{phase} {seconds * 1000:.1f}ms" for phase, seconds in timings.items() \
+            if phase not in ("total", "pygame"))
+        print(f"{name:<28}{timings['total'] * 1000:>8.1f}ms  {phases}{', pygame loaded' if timings['pygame'] else ''}")
+
+# Best practice to ensure the function only runs when the file is run directly
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+'''
+Batch evaluation and Texel-style tuning of the evaluation in chess_ai_agent, using NumPy.
+Positions are encoded as the 64 piece codes of their snapshot (see chess_engine.SNAPSHOT_PIECES), so N positions are an
+N x 64 array, and they are all scored at once with the same piece values and piece position tables as score_board().
+The pawn structure term doesn't depend on the tuned values, so it is scored once per position when the positions are
+extracted and added to the batch scores as it is.
+The tuner fits piece_score and the tables to game results, minimizing the error between each position's result and
+sigmoid(K * score), and writes the tuned values to a JSON file that chess_ai_agent.load_evaluation() can load.
+Usage:
+    python chess_tuning.py extract games.pgn positions.npz
+    python chess_tuning.py tune positions.npz tuned_evaluation.json
+'''
+import argparse
+import array
+import json
+import time
+import numpy as np
+import chess_engine
+import chess_ai_agent as ai
+import chess_pgn
+
+POSITION_FACTOR = 0.3       # score_board() scales the piece position tables by this
+TUNED_PIECE_TYPES = ("P", "R", "N", "B", "Q")       # The king's value doesn't matter since it can't be captured
+SHARED_TABLES = ("R", "N", "B", "Q")        # Tables used for both colors
+RESULT_SCORES = {"1-0": 1.0, "1/2-1/2": 0.5, "0-1": 0.0}
+SKIP_PLIES = 8      # Opening moves left out of the positions, they mostly come from books
+
+def encode_positions(game_states):
+    """
+    Encode the positions as an N x 64 array of piece codes
+    """
+    boards = bytearray()
+    for gs in game_states:
+        boards += gs.get_snapshot()[:64]
+    return np.frombuffer(bytes(boards), dtype=np.uint8).reshape(-1, 64)
+
+def score_pawn_structure(gs):
+    """
+    The pawn structure term of score_board() for a position, 0 with PAWN_STRUCTURE off
+    """
+    if not ai.PAWN_STRUCTURE:
+        return 0
+    return ai.evaluate_pawn_structure(gs.piece_squares['wP'], gs.piece_squares['bP'])
+
+def get_parameters():
+    """
+    The current evaluation of chess_ai_agent as a dictionary of NumPy arrays: the piece values, and an 8x8 table for
+    each piece type plus one for each pawn color
+    """
+    parameters = {"piece_score": np.array([ai.piece_score[piece_type] for piece_type in TUNED_PIECE_TYPES], dtype=float)}
+    for key, table in ai.piece_position_scores.items():
+        parameters[key] = np.zeros((8, 8))
+        parameters[key][:len(table)] = table       # The black pawn table has no row for the last rank
+    return parameters
+
+def build_weights(parameters):
+    """
+    Turn the parameters into a 13 x 64 array holding the score of each piece code on each square, positive for white
+    """
+    weights = np.zeros((len(chess_engine.SNAPSHOT_PIECES), 64))
+    for code, piece in enumerate(chess_engine.SNAPSHOT_PIECES):
+        if piece == "--" or piece[1] == "K":
+            continue
+        value = parameters["piece_score"][TUNED_PIECE_TYPES.index(piece[1])]
+        table = parameters[piece if piece[1] == "P" else piece[1]]
+        sign = 1 if piece[0] == "w" else -1
+        weights[code] = sign * (value + POSITION_FACTOR * table.reshape(64))
+    return weights
+
+def evaluate_batch(boards, weights=None, pawn_scores=None):
+    """
+    Score all the encoded positions at once, the same way score_board() does (checkmates and stalemates aside).
+    pawn_scores are the positions' pawn structure scores, as extract_positions() returns them
+    """
+    return evaluate_squares(np.ascontiguousarray(boards.T), weights, pawn_scores)
+
+def evaluate_squares(squares, weights=None, pawn_scores=None):
+    """
+    evaluate_batch() for positions stored square by square (a 64 x N array), which is faster to go through
+    """
+    if weights is None:
+        weights = build_weights(get_parameters())
+    scores = np.zeros(squares.shape[1]) if pawn_scores is None else np.array(pawn_scores, dtype=float)
+    for square, codes in enumerate(squares):        # One square at a time keeps the memory use at O(N)
+        scores += weights[:, square][codes]
+    return scores
+
+def extract_positions(pgn_path, skip_plies=SKIP_PLIES, max_positions=None):
+    """
+    Replay the games of a PGN file and return the encoded positions, their pawn structure scores and the result of
+    their game (1 for a white win, 0.5 for a draw and 0 for a black win). Games without a result are skipped
+    """
+    boards = bytearray()
+    pawn_scores = array.array("d")
+    results = array.array("f")
+    for game in chess_pgn.read_games_from_path(pgn_path):
+        result = RESULT_SCORES.get(game.result)
+        if result is None:
+            continue
+        try:
+            for ply, (gs, _) in enumerate(game.replay(), 1):
+                if ply > skip_plies:
+                    boards += gs.get_snapshot()[:64]
+                    pawn_scores.append(score_pawn_structure(gs))
+                    results.append(result)
+        except ValueError as error:
+            print("Skipping the rest of a game:", error)
+        if max_positions and len(results) >= max_positions:
+            break
+    return np.frombuffer(bytes(boards), dtype=np.uint8).reshape(-1, 64), np.array(pawn_scores, dtype=float), \
+        np.array(results, dtype=float)
+
+def sigmoid(scores, k):
+    return 1 / (1 + np.exp(-k * scores))
+
+def find_k(boards, pawn_scores, results, weights):
+    """
+    Find the scaling constant K that best maps the current scores to results
+    """
+    scores = evaluate_batch(boards, weights, pawn_scores)
+    best_k, best_error = 1.0, None
+    for k in np.linspace(0.05, 3, 60):
+        error = np.mean((results - sigmoid(scores, k)) ** 2)
+        if best_error is None or error < best_error:
+            best_k, best_error = k, error
+    return best_k
+
+def tune(boards, pawn_scores, results, iterations=500, learning_rate=0.05, verbose=True):
+    """
+    Fit the piece values and the piece position tables to the results with gradient descent (Adam) on the mean
+    squared error between the results and sigmoid(K * score). The pawn structure scores are part of each score
+    but aren't tuned. Returns the tuned parameters
+    """
+    parameters = get_parameters()
+    k = find_k(boards, pawn_scores, results, build_weights(parameters))
+    if verbose:
+        print(f"{len(results)} positions, K = {k:.3f}")
+    squares = np.ascontiguousarray(boards.T)
+    moments = {key: np.zeros_like(value) for key, value in parameters.items()}
+    velocities = {key: np.zeros_like(value) for key, value in parameters.items()}
+    for iteration in range(1, iterations + 1):
+        weights = build_weights(parameters)
+        predictions = sigmoid(evaluate_squares(squares, weights, pawn_scores), k)
+        errors = predictions - results
+        # Gradient of the error with respect to each position's score, then to each weight
+        position_gradients = 2 * errors * k * predictions * (1 - predictions) / len(results)
+        weight_gradients = np.zeros_like(weights)
+        for square, codes in enumerate(squares):
+            weight_gradients[:, square] = np.bincount(codes, weights=position_gradients, minlength=len(weights))
+        gradients = parameter_gradients(weight_gradients)
+        for key, gradient in gradients.items():     # Adam update
+            moments[key] = 0.9 * moments[key] + 0.1 * gradient
+            velocities[key] = 0.999 * velocities[key] + 0.001 * gradient ** 2
+            moment = moments[key] / (1 - 0.9 ** iteration)
+            velocity = velocities[key] / (1 - 0.999 ** iteration)
+            parameters[key] -= learning_rate * moment / (np.sqrt(velocity) + 1e-8)
+        if verbose and (iteration % 50 == 0 or iteration == 1):
+            print(f"Iteration {iteration}: error {np.mean(errors ** 2):.6f}")
+    return parameters
+
+def parameter_gradients(weight_gradients):
+    """
+    Chain the gradients of the 13 x 64 weights back to the parameters they are built from in build_weights()
+    """
+    codes = chess_engine.SNAPSHOT_PIECE_CODES
+    gradients = {"piece_score": np.zeros(len(TUNED_PIECE_TYPES))}
+    for i, piece_type in enumerate(TUNED_PIECE_TYPES):
+        gradients["piece_score"][i] = weight_gradients[codes["w" + piece_type]].sum() - \
+            weight_gradients[codes["b" + piece_type]].sum()
+    for piece_type in SHARED_TABLES:
+        gradients[piece_type] = POSITION_FACTOR * (weight_gradients[codes["w" + piece_type]] - \
+            weight_gradients[codes["b" + piece_type]]).reshape(8, 8)
+    gradients["wP"] = POSITION_FACTOR * weight_gradients[codes["wP"]].reshape(8, 8)
+    gradients["bP"] = -POSITION_FACTOR * weight_gradients[codes["bP"]].reshape(8, 8)
+    return gradients
+
+def save_parameters(parameters, path):
+    """
+    Write the parameters in the JSON format chess_ai_agent.load_evaluation() reads
+    """
+    evaluation = {
+        "piece_score": {piece_type: round(float(value), 3) for piece_type, value in \
+            zip(TUNED_PIECE_TYPES, parameters["piece_score"])},
+        "piece_position_scores": {key: np.round(parameters[key], 3).tolist() for key in ai.piece_position_scores},
+    }
+    evaluation["piece_score"]["K"] = 0
+    with open(path, "w", encoding="utf-8") as evaluation_file:
+        json.dump(evaluation, evaluation_file, indent=1)
+
+def main():
+    parser = argparse.ArgumentParser(description="Tune the evaluation of the chess AI on game results")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    extract_parser = subparsers.add_parser("extract", help="turn the games of a PGN file into a positions file")
+    extract_parser.add_argument("pgn")
+    extract_parser.add_argument("positions", help=".npz file to write")
+    extract_parser.add_argument("--skip-plies", type=int, default=SKIP_PLIES, help="opening plies to leave out")
+    extract_parser.add_argument("--max-positions", type=int, default=None)
+    tune_parser = subparsers.add_parser("tune", help="fit the evaluation to a positions file")
+    tune_parser.add_argument("positions", help=".npz file made by extract")
+    tune_parser.add_argument("output", help="JSON file for the tuned evaluation")
+    tune_parser.add_argument("--iterations", type=int, default=500)
+    tune_parser.add_argument("--learning-rate", type=float, default=0.05)
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    if args.command == "extract":
+        boards, pawn_scores, results = extract_positions(args.pgn, args.skip_plies, args.max_positions)
+        np.savez_compressed(args.positions, boards=boards, pawn_scores=pawn_scores, results=results)
+        print(f"Wrote {len(results)} positions to {args.positions}")
+    else:
+        data = np.load(args.positions)
+        if "pawn_scores" not in data:
+            parser.error(f"{args.positions} has no pawn structure scores, extract the positions again")
+        parameters = tune(data["boards"], data["pawn_scores"], data["results"], args.iterations, args.learning_rate)
+        save_parameters(parameters, args.output)
+        print("Wrote the tuned evaluation to", args.output)
+    print(f"Took {time.perf_counter() - start_time:.1f}s")
+
+# Best practice to ensure the function only runs when the file is run directly
+if __name__ == "__main__":
+    main()